@@ -1,7 +1,14 @@
-import json
 import logging
+import socket
 
-from urllib import request, error
+from functools import partial
+from http import client
+from time import perf_counter, sleep
+from urllib import error
+
+from api_retry import ApiError, RETRYABLE_STATUSES, get_retry_policy, parse_retry_after
+from api_session import get_session
+from json_codec import body_parts, body_size, get_serializer
 
 
 def capfirst(text):
@@ -12,44 +19,115 @@ def capfirst(text):
     return text[:1].upper() + text[1:]
 
 
-def graphql_request(parameters: dict, payload: str) -> dict:
+def format_headers(parameters: dict) -> dict:
     """
-    Performs the actual GraphQL request to Aava-API.
+    Formats the HTTP headers of a request to Aava-API.
 
     Args:
         parameters (dict): Contains URL and credential information for API connection
-        payload (str): A formatted GraphQL request
 
     Returns:
-        dict: _description_
+        dict: The request headers
     """
-    url = parameters["aavaApiServer"] + "/hr"
-    req = request.Request(url, data=payload.encode("utf-8"), method="POST")
-    req.add_header(
-        "X-API-key", f"{parameters['clientId']}:{parameters['clientSecret']}"
-    )
-    req.add_header("Accept", "application/json")
-    req.add_header("Content-Type", "application/json")
-    try:
-        response = request.urlopen(req)
-        result = json.loads(response.read().decode("utf-8"))
-
-        if "errors" in result:
-            error_messages = []
-            for err in result["errors"]:
-                locations = []
-                for loc in err["locations"]:
-                    locations.append(f"row {loc['line']}, column {loc['column']}")
-                error_messages.append(f"{err['message']}, {' & '.join(locations)}")
-            raise ValueError("\n".join(error_messages))
-
-        return result["data"]
-    except error.HTTPError:
-        logging.critical(f"Error importing {type}s. Exiting.")
-        exit()
-    except ValueError as e:
-        logging.error("Invalid content %s", e)
-        return None
+    return {
+        "X-API-key": f"{parameters['clientId']}:{parameters['clientSecret']}",
+        "Accept": "application/json",
+        "Content-Type": "application/json",
+    }
+
+
+def parse_result(result: dict) -> dict:
+    """
+    Extracts the data from a GraphQL response.
+
+    Args:
+        result (dict): The decoded response
+
+    Raises:
+        ValueError: If the response contains GraphQL errors
+
+    Returns:
+        dict: The data of the response
+    """
+    if "errors" in result:
+        error_messages = []
+        for err in result["errors"]:
+            locations = []
+            for loc in err["locations"]:
+                locations.append(f"row {loc['line']}, column {loc['column']}")
+            error_messages.append(f"{err['message']}, {' & '.join(locations)}")
+        raise ValueError("\n".join(error_messages))
+
+    return result["data"]
+
+
+def graphql_request(parameters: dict, payload, stats: dict = None, idempotent: bool = True) -> dict:
+    """
+    Performs the actual GraphQL request to Aava-API. The request is sent over a
+    persistent connection of the session shared by the connections to the same server.
+
+    Requests failing for a reason that may pass (HTTP 429 or 5xx, timeouts and broken
+    connections) are sent again after a delay, as allowed by the retry policy of the
+    connection. Other failures, like other 4xx errors and GraphQL errors, are not retried.
+    A request that is not idempotent, like an import, is not retried after a timeout either,
+    as the server may have received it.
+
+    Args:
+        parameters (dict): Contains URL and credential information for API connection
+        payload (str | bytes | list): A formatted GraphQL request, or the parts of it as bytes
+        stats (dict, optional): Counters 'requests', 'bytes', 'submitSeconds' and 'retries'
+            to be increased
+        idempotent (bool): Whether the request can be sent again after a timeout
+
+    Raises:
+        ApiError: If the request fails and is not retried
+
+    Returns:
+        dict: The data of the response
+    """
+    policy = get_retry_policy(parameters)
+    serializer = get_serializer(parameters)
+    parts = body_parts(payload)
+    attempt = 0
+    while True:
+        retry_after = None
+        started = perf_counter()
+        try:
+            response = get_session(parameters).post("/hr", parts, format_headers(parameters))
+            if stats is not None:
+                stats["requests"] += 1
+                stats["bytes"] += body_size(parts)
+                stats["submitSeconds"] += perf_counter() - started
+            return parse_result(serializer.loads(response))
+        except error.HTTPError as e:
+            if e.code not in RETRYABLE_STATUSES:
+                logging.critical("Request to Aava-API failed with status %s", e.code)
+                raise ApiError(f"HTTP {e.code} {e.reason}", status=e.code) from e
+            retry_after = parse_retry_after(e.headers.get("Retry-After"))
+            failure = e
+        except ValueError as e:
+            logging.error("Invalid content %s", e)
+            raise ApiError(f"Invalid content {e}") from e
+        except socket.timeout as e:
+            if not idempotent:
+                logging.critical("Request to Aava-API timed out: %s", e)
+                raise ApiError(f"Request timed out, it may have been received: {e}") from e
+            failure = e
+        except (OSError, client.HTTPException) as e:
+            failure = e
+
+        if not policy.consume(attempt):
+            logging.critical("Request to Aava-API failed after %s retries: %s", attempt, failure)
+            raise ApiError(f"Request failed after {attempt} retries: {failure}",
+                           status=getattr(failure, "code", None)) from failure
+
+        # Counted also if the request fails in the end
+        if stats is not None:
+            stats["retries"] += 1
+        delay = policy.delay(attempt, retry_after)
+        logging.warning("Request to Aava-API failed (%s), retrying in %.1f seconds", failure, delay)
+        sleep(delay)
+        attempt += 1
 
 
 def format_query(type: str) -> str:
@@ -80,46 +158,246 @@ def format_query(type: str) -> str:
     return query
 
 
-def import_data(type: str, parameters: dict, data: dict) -> dict:
+def format_payload_template(type: str, parameters: dict) -> tuple:
     """
-    Performs the import query of a given type.
+    Splits the serialized import request into the parts surrounding the record list,
+    so that batches of pre-serialized records can be placed in between them.
 
     Args:
         type (str): Type of import (department, costCenter, employee, absence)
         parameters (dict): URL and credentials for Aava-API
-        data (dict): The data that is to be imported
 
     Returns:
-        dict: _description_
+        tuple: The serialized request before and after the record list, as bytes
     """
     request_data = {
         "query": format_query(type),
         "variables": {
             "organizationExternalId": parameters["organizationId"],
-            f"{type}s": data,
+            f"{type}s": None,
         },
     }
-    result = graphql_request(parameters=parameters, payload=json.dumps(request_data))
-    return result
+    # The record list is the last value in the request, so the last 'null' is its placeholder
+    head, tail = get_serializer(parameters).dumps(request_data).rsplit(b"null", 1)
+    return head, tail
+
+
+def split_batches(records, max_records: int = None, max_bytes: int = None, overhead: int = 0,
+                  stats: dict = None, serializer=None, sizer=None):
+    """
+    Serializes the records one by one and groups them into batches that respect the given
+    limits. The records are consumed lazily, so any iterable can be passed.
+
+    Args:
+        records (iterable): The records to be imported
+        max_records (int, optional): Maximum number of records in a batch
+        max_bytes (int, optional): Maximum size of a request in bytes
+        overhead (int, optional): Size of the request excluding the records
+        stats (dict, optional): Counter 'serializeSeconds' to be increased
+        serializer (optional): The JSON serializer, see json_codec.get_serializer
+        sizer (BatchSizer, optional): If given, its current size is used instead of
+            'max_records' for each batch
+
+    Yields:
+        list: JSON serialized records as bytes belonging to the same batch; at least one
+            (possibly empty) batch is always yielded
+    """
+    dumps = (serializer or get_serializer({})).dumps
+    batch = []
+    batch_bytes = overhead + 2
+    batches = 0
+    if sizer:
+        max_records = sizer.next_size()
+    for record in records:
+        started = perf_counter()
+        encoded = dumps(record)
+        if stats is not None:
+            stats["serializeSeconds"] += perf_counter() - started
+        size = len(encoded) + 1
+        if batch and (
+            (max_records and len(batch) >= max_records)
+            or (max_bytes and batch_bytes + size > max_bytes)
+        ):
+            yield batch
+            batches += 1
+            batch = []
+            batch_bytes = overhead + 2
+            if sizer:
+                max_records = sizer.next_size()
+        if max_bytes and not batch and overhead + 2 + size > max_bytes:
+            logging.warning(
+                "A single record exceeds the batch size of %s bytes, sending it alone", max_bytes
+            )
+        batch.append(encoded)
+        batch_bytes += size
+
+    if batch or batches == 0:
+        yield batch
+
+
+def import_data(type: str, parameters: dict, data: list, poller=None, stats: dict = None,
+                journal=None, sizer=None) -> dict:
+    """
+    Performs the import query of a given type. If the connection parameters contain
+    'batchSize' (records) or 'batchBytes' (request size) limits, the data is split into
+    successive imports and the message IDs of all of them are returned.
+
+    Args:
+        type (str): Type of import (department, costCenter, employee, absence)
+        parameters (dict): URL and credentials for Aava-API
+        data (iterable): The data that is to be imported, consumed one batch at a time
+        poller (StatusPoller, optional): If given, each batch waits for a free slot
+            in the poller before it is sent, and is then tracked by it
+        stats (dict, optional): Counters of the import to be increased, see
+            run_metrics.new_import_stats
+        journal (ConnectionJournal, optional): If given, each batch is recorded in the
+            checkpoint journal, and batches already sent by an interrupted run are not
+            sent again unless they failed
+        sizer (BatchSizer, optional): If given, the number of records in each batch
+            is taken from it instead of 'batchSize', and it is told how long the
+            batches take to send and to process
+
+    Raises:
+        ApiError: If a batch could not be sent; the batches before it have been sent,
+            and their message IDs are in its 'message_ids'
+
+    Returns:
+        dict: A dictionary object with key 'import<Type>s', under which 'messageIds' lists
+            the message IDs of all the batches, 'messageId' is the first one of them and
+            'recordCount' is the number of records sent
+    """
+    message_ids = []
+    record_count = 0
+    # When resuming, the batch sizes of the interrupted run are used again, as
+    # the batches are recognized by their content
+    if journal and sizer:
+        sizer.replay(journal.batch_counts(type))
+    payloads = format_import_payloads(type, parameters, data, stats, sizer)
+    for index, (count, payload) in enumerate(payloads):
+        # The size the batch was formed with, before the next batch is formed
+        sent_size = sizer.batch_size if sizer else None
+        if journal:
+            batch_hash = journal.batch_hash(payload)
+            previous = journal.previous_batch(type, batch_hash)
+            if previous:
+                msg_id, status = previous
+                logging.info("Batch #%s of %ss was sent earlier as %s", index + 1, type, msg_id)
+                message_ids.append(msg_id)
+                record_count += count
+                if poller:
+                    poller.resume(msg_id, type, status)
+                continue
+
+        if poller:
+            poller.wait_for_slot()
+        started = perf_counter()
+        try:
+            result = graphql_request(parameters=parameters, payload=payload, stats=stats,
+                                     idempotent=False)
+        except ApiError as e:
+            logging.error("Batch #%s of %ss (%s records) was not imported", index + 1, type, count)
+            if sizer:
+                sizer.sent(sent_size, float("inf"))
+            e.message_ids = list(message_ids)
+            raise
+        latency = perf_counter() - started
+        message_ids.append(result[f"import{capfirst(type)}s"]["messageId"])
+        record_count += count
+        if stats is not None:
+            stats["records"] += count
+            stats["batches"] += 1
+        if journal:
+            journal.sent_batch(type, batch_hash, message_ids[-1], index, count)
+        if sizer:
+            sizer.sent(sent_size, latency)
+        if poller:
+            poller.track(message_ids[-1], type,
+                         partial(sizer.finished, count, sent_size, body_size(payload), latency)
+                         if sizer else None)
+
+    return format_import_result(type, message_ids, record_count)
+
+
+def format_import_payloads(type: str, parameters: dict, data: list, stats: dict = None,
+                           sizer=None):
+    """
+    Formats the import requests of a given type, split into batches according to the
+    'batchSize' and 'batchBytes' connection parameters.
+
+    Args:
+        type (str): Type of import (department, costCenter, employee, absence)
+        parameters (dict): URL and credentials for Aava-API
+        data (iterable): The data that is to be imported
+        stats (dict, optional): Counter 'serializeSeconds' to be increased
+        sizer (BatchSizer, optional): Sets the number of records in each batch instead
+            of 'batchSize'
+
+    Yields:
+        tuple: The number of records in the batch and the formatted request as a list
+            of byte strings, which are sent one after another without joining them
+    """
+    head, tail = format_payload_template(type, parameters)
+    batches = split_batches(
+        data,
+        max_records=parameters.get("batchSize"),
+        max_bytes=parameters.get("batchBytes"),
+        overhead=len(head) + len(tail),
+        stats=stats,
+        serializer=get_serializer(parameters),
+        sizer=sizer,
+    )
+    for batch in batches:
+        # The records separated by commas, e.g. [r1, b",", r2, b",", r3]
+        records = [b","] * max(2 * len(batch) - 1, 0)
+        records[::2] = batch
+        yield len(batch), [head, b"["] + records + [b"]", tail]
+
+
+def format_import_result(type: str, message_ids: list, record_count: int) -> dict:
+    """
+    Collects the message IDs of the batches of an import in one result.
+
+    Args:
+        type (str): Type of import (department, costCenter, employee, absence)
+        message_ids (list): The message IDs of the successfully sent batches
+        record_count (int): The number of records in the successfully sent batches
+
+    Returns:
+        dict: The result as returned by import_data, or None if nothing was sent
+    """
+    if not message_ids:
+        return None
+
+    return {
+        f"import{capfirst(type)}s": {
+            "messageId": message_ids[0],
+            "messageIds": message_ids,
+            "recordCount": record_count,
+        }
+    }
 
 
-def import_departments(parameters: dict, departments: dict) -> dict:
-    return import_data("department", parameters, departments)
+def import_departments(parameters: dict, departments: dict, poller=None, stats: dict = None,
+                       journal=None, sizer=None) -> dict:
+    return import_data("department", parameters, departments, poller, stats, journal, sizer)
 
 
-def import_cost_centers(parameters: dict, costCenters: dict) -> dict:
-    return import_data("costCenter", parameters, costCenters)
+def import_cost_centers(parameters: dict, costCenters: dict, poller=None, stats: dict = None,
+                        journal=None, sizer=None) -> dict:
+    return import_data("costCenter", parameters, costCenters, poller, stats, journal, sizer)
 
 
-def import_employees(parameters: dict, employees: dict) -> dict:
-    return import_data("employee", parameters, employees)
+def import_employees(parameters: dict, employees: dict, poller=None, stats: dict = None,
+                     journal=None, sizer=None) -> dict:
+    return import_data("employee", parameters, employees, poller, stats, journal, sizer)
 
 
-def import_absences(parameters: dict, absences) -> dict:
-    return import_data("absence", parameters, absences)
+def import_absences(parameters: dict, absences, poller=None, stats: dict = None,
+                    journal=None, sizer=None) -> dict:
+    return import_data("absence", parameters, absences, poller, stats, journal, sizer)
 
 
-def get_statuses(parameters: dict, message_ids: list) -> dict:
+def get_statuses(parameters: dict, message_ids: list, stats: dict = None) -> dict:
     """
     Used to query the status of import operations. Returns a list of status objects, each object containing
     the request ID ('messageId'), timestamp ('timestamp'), import type ('importType') and the current status
@@ -130,11 +408,27 @@ def get_statuses(parameters: dict, message_ids: list) -> dict:
     Args:
         parameters (dict): Parameters for connecting to Aava API (see properties-template.json)
         message_ids (list): An array containing the message IDs received from import requests
+        stats (dict, optional): Counters of the requests to be increased, see graphql_request
 
     Returns:
         dict: A dictionary object with key 'processingStatusWithVerify', under which there is an array of status objects
     """
 
+    return graphql_request(parameters, format_status_request(parameters, message_ids), stats)
+
+
+def format_status_request(parameters: dict, message_ids: list) -> str:
+    """
+    Formats a status query for the given imports.
+
+    Args:
+        parameters (dict): Parameters for connecting to Aava API (see properties-template.json)
+        message_ids (list): An array containing the message IDs received from import requests
+
+    Returns:
+        bytes: The formatted request that can be passed to Aava-API
+    """
+
     request_data = {
         "query": """
             query processingStatusWithVerify(
@@ -160,4 +454,4 @@ def get_statuses(parameters: dict, message_ids: list) -> dict:
         },
     }
 
-    return graphql_request(parameters, json.dumps(request_data))
+    return get_serializer(parameters).dumps(request_data)
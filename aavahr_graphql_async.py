@@ -0,0 +1,200 @@
+import asyncio
+import gzip
+import logging
+
+import aiohttp
+
+from api_retry import ApiError, RETRYABLE_STATUSES, get_retry_policy, parse_retry_after
+from aavahr_graphql import (
+    capfirst,
+    format_headers,
+    format_import_payloads,
+    format_import_result,
+    format_status_request,
+    parse_result,
+)
+from json_codec import body_parts, get_serializer
+
+
+class AsyncApiClient:
+    """
+    An asyncio variant of the functions in aavahr_graphql. Requests are formatted and
+    responses parsed by the same code as in the blocking functions, but they are sent
+    over an aiohttp session, so that many imports and status queries can be run on one
+    event loop. The number of simultaneous requests is limited by 'concurrency', and
+    as many connections are kept open unless the connection parameter 'poolSize' is set.
+
+    The connection parameters 'batchSize', 'batchBytes', 'requestTimeout' and
+    'gzipRequests' are used as with the blocking functions.
+
+    Usage:
+        async with AsyncApiClient(conn, concurrency=20) as client:
+            res = await client.import_employees(employees)
+            statuses = await client.get_statuses(res['importEmployees']['messageIds'])
+
+    Args:
+        parameters (dict): Contains URL and credential information for API connection
+        concurrency (int): Maximum number of requests in progress at once
+    """
+
+    def __init__(self, parameters: dict, concurrency: int = 10):
+        self.parameters = parameters
+        self.concurrency = concurrency
+        self.semaphore = None
+        self.session = None
+
+    async def __aenter__(self):
+        # Created here, so that the semaphore belongs to the running event loop
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.parameters.get("poolSize", self.concurrency)),
+            timeout=aiohttp.ClientTimeout(total=self.parameters.get("requestTimeout")),
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    async def graphql_request(self, payload, idempotent: bool = True) -> dict:
+        """
+        Performs the actual GraphQL request to Aava-API. Failed requests are retried
+        with the same retry policy as in aavahr_graphql.graphql_request.
+
+        Args:
+            payload (str | bytes | list): A formatted GraphQL request, or the parts of it as bytes
+            idempotent (bool): Whether the request can be sent again after a timeout
+
+        Raises:
+            ApiError: If the request fails and is not retried
+
+        Returns:
+            dict: The data of the response
+        """
+        url = self.parameters["aavaApiServer"] + "/hr"
+        headers = format_headers(self.parameters)
+        serializer = get_serializer(self.parameters)
+        body = b"".join(body_parts(payload))
+        if self.parameters.get("gzipRequests", False):
+            body = gzip.compress(body)
+            headers["Content-Encoding"] = "gzip"
+
+        policy = get_retry_policy(self.parameters)
+        attempt = 0
+        while True:
+            retry_after = None
+            try:
+                async with self.semaphore:
+                    async with self.session.post(url, data=body, headers=headers) as response:
+                        if response.status >= 400 and response.status not in RETRYABLE_STATUSES:
+                            logging.critical("Request to Aava-API failed with status %s", response.status)
+                            raise ApiError(f"HTTP {response.status} {response.reason}", status=response.status)
+                        if response.status >= 400:
+                            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                            raise aiohttp.ClientResponseError(
+                                response.request_info, response.history,
+                                status=response.status, message=response.reason)
+                        return parse_result(serializer.loads(await response.read()))
+            except ValueError as e:
+                logging.error("Invalid content %s", e)
+                raise ApiError(f"Invalid content {e}") from e
+            except asyncio.TimeoutError as e:
+                if not idempotent:
+                    logging.critical("Request to Aava-API timed out")
+                    raise ApiError("Request timed out, it may have been received") from e
+                failure = e
+            except aiohttp.ClientError as e:
+                failure = e
+
+            if not policy.consume(attempt):
+                logging.critical("Request to Aava-API failed after %s retries: %s", attempt, failure)
+                raise ApiError(f"Request failed after {attempt} retries: {failure}",
+                               status=getattr(failure, "status", None)) from failure
+
+            delay = policy.delay(attempt, retry_after)
+            logging.warning("Request to Aava-API failed (%s), retrying in %.1f seconds", failure, delay)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def import_data(self, type: str, data: list) -> dict:
+        """
+        Performs the import query of a given type. The batches are sent concurrently.
+
+        Args:
+            type (str): Type of import (department, costCenter, employee, absence)
+            data (list): The data that is to be imported
+
+        Raises:
+            ApiError: If a batch could not be sent; the message IDs of the batches that
+                were sent are in its 'message_ids'
+
+        Returns:
+            dict: The result in the same format as returned by aavahr_graphql.import_data
+        """
+        # Only as many batches are formatted in advance as can be sent at once,
+        # so that the memory use does not depend on the size of the import
+        window = asyncio.Semaphore(self.concurrency)
+
+        async def send(payload):
+            try:
+                return await self.graphql_request(payload, idempotent=False)
+            finally:
+                window.release()
+
+        counts = []
+        tasks = []
+        try:
+            for count, payload in format_import_payloads(type, self.parameters, data):
+                await window.acquire()
+                counts.append(count)
+                tasks.append(asyncio.ensure_future(send(payload)))
+        except BaseException:
+            # The batches being sent are not left running when e.g. reading the
+            # records fails
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+
+        message_ids = []
+        record_count = 0
+        failure = None
+        for index, result in enumerate(results):
+            if isinstance(result, BaseException):
+                logging.error("Batch #%s of %ss (%s records) was not imported",
+                              index + 1, type, counts[index])
+                failure = failure or result
+                continue
+            message_ids.append(result[f"import{capfirst(type)}s"]["messageId"])
+            record_count += counts[index]
+
+        if failure:
+            # The batches that were sent are processed anyway, so they can be polled
+            if isinstance(failure, ApiError):
+                failure.message_ids = message_ids
+            raise failure
+        return format_import_result(type, message_ids, record_count)
+
+    async def import_departments(self, departments: list) -> dict:
+        return await self.import_data("department", departments)
+
+    async def import_cost_centers(self, costCenters: list) -> dict:
+        return await self.import_data("costCenter", costCenters)
+
+    async def import_employees(self, employees: list) -> dict:
+        return await self.import_data("employee", employees)
+
+    async def import_absences(self, absences: list) -> dict:
+        return await self.import_data("absence", absences)
+
+    async def get_statuses(self, message_ids: list) -> dict:
+        """
+        Queries the status of import operations, see aavahr_graphql.get_statuses.
+
+        Args:
+            message_ids (list): An array containing the message IDs received from import requests
+
+        Returns:
+            dict: A dictionary object with key 'processingStatusWithVerify', under which there is an array of status objects
+        """
+        return await self.graphql_request(format_status_request(self.parameters, message_ids))
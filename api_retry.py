@@ -0,0 +1,128 @@
+import random
+import threading
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+
+# HTTP statuses meaning that the same request may succeed later
+RETRYABLE_STATUSES = [429, 500, 502, 503, 504]
+
+# Retry policies are shared by the connections to the same organization
+POLICIES = {}
+POLICIES_LOCK = threading.Lock()
+
+
+class ApiError(Exception):
+    """Raised when a request to Aava-API fails and is not, or can no longer be, retried.
+
+    Args:
+        message (str): Description of the failure
+        status (int, optional): HTTP status of the response, if any
+        message_ids (list, optional): If an import of many batches failed, the message
+            IDs of the batches that were sent, so that their statuses can still be polled
+    """
+
+    def __init__(self, message, status=None, message_ids=None):
+        super().__init__(message)
+        self.status = status
+        self.message_ids = message_ids or []
+
+
+class RetryPolicy:
+    """Decides how long to wait before retrying a failed request, and how many
+    retries can still be made.
+
+    The imports are keyed by external IDs, so sending the same batch again is
+    safe even if the first attempt was processed after all.
+
+    Args:
+        max_retries (int): Maximum number of retries of a single request
+        backoff (float): Delay before the first retry in seconds, doubled on each retry
+        max_backoff (float): Maximum delay in seconds
+        budget (int): Maximum number of retries of all the requests together
+    """
+
+    def __init__(self, max_retries=5, backoff=1.0, max_backoff=60, budget=50):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.budget = budget
+        self.retries = 0
+        self.lock = threading.Lock()
+
+    def consume(self, attempt):
+        """Checks whether the request may be retried once more, and if so,
+        takes the retry from the budget.
+
+        Args:
+            attempt (int): Number of retries already made for the request
+
+        Returns:
+            bool: Whether the request may be retried
+        """
+        if attempt >= self.max_retries:
+            return False
+        with self.lock:
+            if self.retries >= self.budget:
+                return False
+            self.retries += 1
+            return True
+
+    def delay(self, attempt, retry_after=None):
+        """Returns the delay before the next retry in seconds. If the server
+        told how long to wait, that is honored.
+
+        Args:
+            attempt (int): Number of retries already made for the request
+            retry_after (float, optional): Delay requested by the server
+        """
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff)
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+
+def parse_retry_after(value):
+    """Parses the value of a Retry-After header, which is either a number of
+    seconds or an HTTP date.
+
+    Args:
+        value (str): The header value, or None
+
+    Returns:
+        float: The delay in seconds, or None if the value is missing or invalid
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def get_retry_policy(parameters: dict) -> RetryPolicy:
+    """
+    Returns the retry policy of the organization of the connection, creating it if needed.
+    The policy is configured by the optional connection parameters 'maxRetries' (default 5),
+    'retryBackoff' (seconds, default 1), 'maxRetryBackoff' (seconds, default 60) and
+    'retryBudget' (retries per run, default 50).
+
+    Args:
+        parameters (dict): Contains URL and credential information for API connection
+
+    Returns:
+        RetryPolicy: The policy shared by the connections to the same organization
+    """
+    key = (parameters["aavaApiServer"], parameters["organizationId"])
+    with POLICIES_LOCK:
+        if key not in POLICIES:
+            POLICIES[key] = RetryPolicy(
+                max_retries=parameters.get("maxRetries", 5),
+                backoff=parameters.get("retryBackoff", 1.0),
+                max_backoff=parameters.get("maxRetryBackoff", 60),
+                budget=parameters.get("retryBudget", 50),
+            )
+        return POLICIES[key]
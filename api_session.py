@@ -0,0 +1,198 @@
+import atexit
+import threading
+import zlib
+from base64 import b64encode
+from http import client
+from io import BytesIO
+from queue import LifoQueue, Empty
+from urllib import error, request
+from urllib.parse import unquote, urlsplit
+
+from json_codec import body_blocks, body_parts, body_size
+
+# Sessions are shared by all the connections using the same Aava-API server
+SESSIONS = {}
+SESSIONS_LOCK = threading.Lock()
+
+# Errors meaning that a kept-alive connection was closed by the server
+# while it was idle in the pool
+STALE_CONNECTION_ERRORS = (client.RemoteDisconnected, BrokenPipeError, ConnectionResetError)
+
+
+def get_proxy(url):
+    """Returns the proxy of the server as set in the environment, e.g. with
+    HTTPS_PROXY and NO_PROXY like for urllib, or None if it is not used.
+
+    Args:
+        url (SplitResult): The split URL of the server
+    """
+    proxy = request.getproxies().get(url.scheme)
+    if not proxy or request.proxy_bypass(url.netloc):
+        return None
+    if '://' not in proxy:
+        proxy = 'http://' + proxy
+    return urlsplit(proxy)
+
+
+class ApiSession:
+    """Keeps a pool of persistent HTTP connections to one Aava-API server,
+    so that the TCP and TLS handshakes are not repeated for every request.
+
+    If a proxy is set in the environment, the connections are made through
+    it: HTTPS requests are tunnelled with CONNECT, and HTTP requests are sent
+    to the proxy.
+
+    Args:
+        server (str): URL of the server, e.g. https://api.aava.fi
+        pool_size (int): Maximum number of simultaneous connections
+        timeout (float, optional): Timeout for connecting and reading in seconds
+        gzip_requests (bool): Whether the request bodies are gzip compressed
+    """
+
+    def __init__(self, server, pool_size=4, timeout=None, gzip_requests=False):
+        url = urlsplit(server)
+        self.server = server
+        self.host = url.hostname
+        self.port = url.port
+        self.path = url.path.rstrip('/')
+        self.https = url.scheme == 'https'
+        self.connection_class = client.HTTPSConnection if self.https else client.HTTPConnection
+        self.timeout = timeout
+        self.gzip_requests = gzip_requests
+        self.slots = threading.BoundedSemaphore(pool_size)
+        self.idle = LifoQueue()
+
+        self.proxy = get_proxy(url)
+        self.proxy_headers = {}
+        if self.proxy and self.proxy.username:
+            credentials = '{}:{}'.format(unquote(self.proxy.username),
+                                         unquote(self.proxy.password or ''))
+            self.proxy_headers['Proxy-Authorization'] = \
+                'Basic ' + b64encode(credentials.encode()).decode()
+        # Requests sent to an HTTP proxy name the server in the path
+        self.prefix = '' if self.https or not self.proxy else \
+            '{}://{}'.format(url.scheme, url.netloc)
+
+    def new_connection(self):
+        if not self.proxy:
+            return self.connection_class(self.host, self.port, timeout=self.timeout)
+        conn = self.connection_class(self.proxy.hostname, self.proxy.port or 80,
+                                     timeout=self.timeout)
+        if self.https:
+            conn.set_tunnel(self.host, self.port, self.proxy_headers)
+        return conn
+
+    def post(self, path, body, headers):
+        """Sends a POST request using a pooled connection. The body may be given
+        in parts, which are written to the connection block by block instead of
+        being joined into one string first.
+
+        Args:
+            path (str): Path of the endpoint, e.g. /hr
+            body (bytes | list): The request body, or the parts of it as bytes
+            headers (dict): Request headers
+
+        Raises:
+            HTTPError: If the server responds with an error status
+
+        Returns:
+            bytes: The response body
+        """
+        headers = dict(headers)
+        parts = body_parts(body)
+        if self.gzip_requests:
+            parts = compress_parts(parts)
+            headers["Content-Encoding"] = "gzip"
+        headers["Content-Length"] = str(body_size(parts))
+
+        with self.slots:
+            try:
+                conn = self.idle.get_nowait()
+                reused = True
+            except Empty:
+                conn = self.new_connection()
+                reused = False
+
+            try:
+                response = self.send(conn, path, parts, headers)
+            except STALE_CONNECTION_ERRORS:
+                conn.close()
+                if not reused:
+                    raise
+                conn = self.new_connection()
+                response = self.send(conn, path, parts, headers)
+            except Exception:
+                conn.close()
+                raise
+
+            data = response.read()
+            if response.will_close:
+                conn.close()
+            else:
+                self.idle.put(conn)
+
+        if response.status >= 400:
+            raise error.HTTPError(self.server + path, response.status, response.reason,
+                                  response.headers, BytesIO(data))
+        return data
+
+    def send(self, conn, path, parts, headers):
+        body = parts[0] if len(parts) == 1 else body_blocks(parts)
+        if self.prefix:
+            headers = dict(headers, **self.proxy_headers)
+        conn.request("POST", self.prefix + self.path + path, body=body, headers=headers)
+        return conn.getresponse()
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except Empty:
+                return
+
+
+def compress_parts(parts):
+    """Compresses the parts of a request body in gzip format one at a time.
+
+    Args:
+        parts (list): The parts of the body as bytes
+
+    Returns:
+        list: The compressed body in parts
+    """
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    compressed = [compressor.compress(part) for part in parts]
+    compressed.append(compressor.flush())
+    return [part for part in compressed if part]
+
+
+def get_session(parameters: dict) -> ApiSession:
+    """
+    Returns the session for the Aava-API server of the connection, creating it if needed.
+    The session is configured by the optional connection parameters 'poolSize',
+    'requestTimeout' and 'gzipRequests' of the first connection using the server.
+
+    Args:
+        parameters (dict): Contains URL and credential information for API connection
+
+    Returns:
+        ApiSession: The session shared by all the connections to the same server
+    """
+    server = parameters["aavaApiServer"]
+    with SESSIONS_LOCK:
+        if server not in SESSIONS:
+            SESSIONS[server] = ApiSession(
+                server,
+                pool_size=parameters.get("poolSize", 4),
+                timeout=parameters.get("requestTimeout"),
+                gzip_requests=parameters.get("gzipRequests", False),
+            )
+        return SESSIONS[server]
+
+
+@atexit.register
+def close_sessions():
+    with SESSIONS_LOCK:
+        for session in SESSIONS.values():
+            session.close()
+        SESSIONS.clear()
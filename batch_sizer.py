@@ -0,0 +1,178 @@
+import json
+import os
+import threading
+from collections import deque
+
+DEFAULT_BATCH_SIZE_FILE = 'batch-sizes.json'
+
+# The batch size is kept within these limits, starts from this size unless
+# 'batchSize' is given or a size was learned earlier, and is tuned so that a
+# batch takes about this many seconds to send and process
+MIN_BATCH_SIZE = 10
+MAX_BATCH_SIZE = 50000
+INITIAL_BATCH_SIZE = 1000
+TARGET_SECONDS = 30
+
+# The size changes at most by this factor at a time
+MAX_STEP = 2
+
+
+class BatchSizer:
+    """Tunes the number of records in the batches of one import type of a
+    connection, so that a batch takes about 'target' seconds to send and to
+    be processed until its status is DONE. Larger batches would stay long in
+    progress and risk the poll timeout, while smaller ones cost more requests.
+
+    The cost of a record is estimated from the request latencies and the
+    time the server has been busy with the batches. The latency is taken to
+    grow with the payload bytes, so it is scaled by the bytes per record of
+    the latest batch, while the server time grows with the records. The
+    batches are assumed to be processed one after another, so a batch takes
+    the time from its submission, or from the end of the previous batch if
+    that was later, until it is reported DONE.
+
+    A batch changes the size at most by MAX_STEP from the size it was sent
+    with, so that the batches of an import finished at the same time do not
+    change it many steps at once.
+
+    Args:
+        size (int): The initial batch size
+        target (float): The targeted time of a batch in seconds
+    """
+
+    def __init__(self, size, target=TARGET_SECONDS):
+        self.lock = threading.Lock()
+        self.size = size
+        self.target = target
+        self.seconds_per_record = None
+        # Sizes of the first batches to be used as they are, see replay
+        self.replayed = deque()
+        # The size given to the latest batch, see next_size
+        self.batch_size = size
+        # Totals of the batches finished during this run
+        self.records = 0
+        self.bytes = 0
+        self.latency = 0
+        self.busy = 0
+        self.last_done = None
+
+    def replay(self, counts):
+        """Makes the first batches the given sizes, e.g. the batches of an
+        interrupted run being resumed, so that they are recognized as sent.
+
+        Args:
+            counts (list): Numbers of records of the batches in order
+        """
+        with self.lock:
+            self.replayed = deque(counts)
+
+    def next_size(self):
+        """Returns the number of records in the next batch, which is also
+        the size the batch is later reported with, see batch_size."""
+        with self.lock:
+            if self.replayed:
+                self.batch_size = self.replayed.popleft()
+            else:
+                self.batch_size = self.size
+            return self.batch_size
+
+    def clamp(self, size, sent_size):
+        size = max(sent_size / MAX_STEP, min(sent_size * MAX_STEP, size))
+        return int(max(MIN_BATCH_SIZE, min(MAX_BATCH_SIZE, size)))
+
+    def shrink(self, sent_size):
+        self.size = min(self.size, self.clamp(sent_size / MAX_STEP, sent_size))
+
+    def sent(self, sent_size, latency):
+        """Records the latency of a request sending a batch. If a request
+        alone takes longer than the target, the batches are halved at once.
+
+        Args:
+            sent_size (int): The batch size the batch was formed with
+            latency (float): Duration of the request in seconds
+        """
+        with self.lock:
+            if latency > self.target:
+                self.shrink(sent_size)
+
+    def finished(self, count, sent_size, payload_bytes, latency, status, submitted, done):
+        """Records a finished batch and adjusts the batch size.
+
+        Args:
+            count (int): Number of records in the batch
+            sent_size (int): The batch size the batch was formed with
+            payload_bytes (int): Size of the request sending the batch
+            latency (float): Duration of the request sending the batch in seconds
+            status (dict): The final status object of the batch
+            submitted (float): Monotonic time of the submission
+            done (float): Monotonic time when the batch was found finished
+        """
+        with self.lock:
+            if status['importStatus'] in ['TIMEOUT', 'FAILURE']:
+                self.shrink(sent_size)
+                return
+
+            start = submitted if self.last_done is None else max(submitted, self.last_done)
+            self.busy += max(0, done - start)
+            self.last_done = done if self.last_done is None else max(done, self.last_done)
+            self.latency += latency
+            self.records += count
+            self.bytes += payload_bytes
+            if not count or not self.bytes or self.latency + self.busy <= 0:
+                return
+            self.seconds_per_record = \
+                self.latency / self.bytes * payload_bytes / count + self.busy / self.records
+            self.size = self.clamp(self.target / self.seconds_per_record, sent_size)
+
+
+class BatchSizeStore:
+    """Keeps the batch sizes learned for each import type of each connection
+    in a JSON file, so that the next run starts from them.
+
+    Args:
+        filename (str): Path of the JSON file
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.sizers = {}
+        self.saved = {}
+        if os.path.exists(filename):
+            with open(filename) as sizes_file:
+                self.saved = json.load(sizes_file)
+
+    def sizer(self, conn, conn_name, import_type):
+        """Returns the batch sizer of an import type of a connection, or None
+        if adaptive batch sizes are not enabled for the connection with the
+        connection parameter 'adaptiveBatchSize'.
+
+        Args:
+            conn (dict): Parameters of the connection
+            conn_name (str): Name of the connection
+            import_type (str): Type of the import (department, employee, ...)
+        """
+        if not conn.get('adaptiveBatchSize'):
+            return None
+        with self.lock:
+            key = (conn_name, import_type)
+            if key not in self.sizers:
+                saved = self.saved.get(conn_name, {}).get(import_type, {})
+                self.sizers[key] = BatchSizer(
+                    saved.get('size', conn.get('batchSize', INITIAL_BATCH_SIZE)),
+                    conn.get('batchTargetSeconds', TARGET_SECONDS))
+            return self.sizers[key]
+
+    def save(self):
+        """Writes the current batch sizes to the file."""
+        with self.lock:
+            if not self.sizers:
+                return
+            for (conn_name, import_type), sizer in self.sizers.items():
+                learned = self.saved.setdefault(conn_name, {}).setdefault(import_type, {})
+                learned['size'] = sizer.size
+                # Saved for information only, the size is what the next run starts from
+                if sizer.seconds_per_record:
+                    learned['secondsPerRecord'] = sizer.seconds_per_record
+            with open(self.filename, 'w') as sizes_file:
+                json.dump(self.saved, sizes_file, indent=2)
@@ -0,0 +1,129 @@
+import gzip
+import json
+import random
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import monotonic, sleep
+
+# The import type reported in the status for each import mutation
+IMPORT_TYPES = {
+    'departments': 'DEPARTMENT',
+    'costCenters': 'COST_CENTER',
+    'employees': 'EMPLOYEE',
+    'absences': 'ABSENCE',
+}
+
+
+class MockAavaServer:
+    """A local stand-in for the GraphQL endpoint of Aava-API, implementing the
+    import mutations and the 'processingStatusWithVerify' query well enough
+    for measuring the integration.
+
+    Args:
+        port (int): Port to listen to, 0 picks a free one
+        latency (float): Delay before responding to any request in seconds
+        processing_delay (float): Time an import stays IN_PROGRESS in seconds
+        per_record_delay (float): Additional processing time per record in seconds
+        error_rate (float): Share of requests answered with HTTP 503
+    """
+
+    def __init__(self, port=0, latency=0.0, processing_delay=0.5, per_record_delay=0.0,
+                 error_rate=0.0):
+        self.latency = latency
+        self.processing_delay = processing_delay
+        self.per_record_delay = per_record_delay
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.imports = {}
+        self.reset_counters()
+
+        handler = type('Handler', (MockRequestHandler,), {'mock': self})
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        self.thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self.port)
+
+    def reset_counters(self):
+        with self.lock:
+            self.counters = {'importRequests': 0, 'statusRequests': 0, 'errors': 0,
+                             'records': 0, 'bytes': 0}
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def count(self, counter, amount=1):
+        with self.lock:
+            self.counters[counter] += amount
+
+    def handle(self, request):
+        """Returns the response to a decoded GraphQL request."""
+        variables = request['variables']
+        if 'messageIds' in variables:
+            self.count('statusRequests')
+            now = monotonic()
+            statuses = []
+            for msg_id in variables['messageIds']:
+                import_type, ready = self.imports.get(msg_id, (None, None))
+                if import_type is None:
+                    status = 'UNKNOWN'
+                elif now < ready:
+                    status = 'IN_PROGRESS'
+                else:
+                    status = 'DONE'
+                statuses.append({'messageId': msg_id, 'importType': import_type,
+                                 'importStatus': status, 'timestamp': None,
+                                 'error': None, 'warnings': []})
+            return {'data': {'processingStatusWithVerify': statuses}}
+
+        key = next(k for k in variables if k != 'organizationExternalId')
+        records = len(variables[key])
+        self.count('importRequests')
+        self.count('records', records)
+        msg_id = str(uuid.uuid4())
+        with self.lock:
+            self.imports[msg_id] = (
+                IMPORT_TYPES.get(key),
+                monotonic() + self.processing_delay + self.per_record_delay * records)
+        return {'data': {'import' + key[:1].upper() + key[1:]: {'messageId': msg_id}}}
+
+
+class MockRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    mock = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.mock.count('bytes', len(body))
+        if self.mock.latency:
+            sleep(self.mock.latency)
+
+        if self.mock.error_rate and random.random() < self.mock.error_rate:
+            self.mock.count('errors')
+            self.send_response(503)
+            self.send_header('Retry-After', '0')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        response = json.dumps(self.mock.handle(json.loads(body))).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
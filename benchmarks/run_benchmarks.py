@@ -0,0 +1,141 @@
+"""
+Measures the throughput of the integration against a local mock of Aava-API.
+
+Each scenario (data size, source adapter and upload mode) is run in its own
+process, so that the peak memory use of the scenarios can be told apart. The
+mock server runs in this process and counts the requests it receives.
+
+Run from the repository root:
+
+    python -m benchmarks.run_benchmarks --sizes 1000,10000 --modes single,batched,pipelined
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+
+from benchmarks.mock_aava_server import MockAavaServer
+
+# Connection parameters of each upload mode, and whether it is run pipelined
+MODES = {
+    'single': ({}, False),
+    'batched': ({'batchSize': 5000}, False),
+    'pipelined': ({'batchSize': 5000}, True),
+    'gzip': ({'batchSize': 5000, 'gzipRequests': True}, True),
+}
+
+# Source adapter properties of each adapter
+ADAPTERS = {
+    'generator': {'moduleName': 'benchmarks.synthetic_data'},
+    'list': {'moduleName': 'benchmarks.synthetic_data', 'materialize': True},
+}
+
+
+def run_child(scenario):
+    """Runs one scenario in this process and prints the results as JSON."""
+    import sync_data
+    from log_handler import LOG_LEVEL
+    from run_metrics import RunMetrics
+
+    parameters, pipelined = MODES[scenario['mode']]
+    source = dict(ADAPTERS[scenario['adapter']], employees=scenario['size'])
+    conn = dict(parameters,
+                connectionName='benchmark',
+                aavaApiServer=scenario['server'],
+                clientId='benchmark',
+                clientSecret='benchmark',
+                organizationId='benchmark',
+                pollInterval=0.1,
+                hrMgmtSystem=source,
+                hourTrackingSystem=source)
+
+    # The command line arguments are parsed by sync_data from sys.argv
+    sys.argv[1:] = ['--pipelined'] if pipelined else []
+    args = sync_data.get_command_line_arguments()
+
+    # Only the failures are printed, so that the results can be read from stdout
+    log_file = tempfile.NamedTemporaryFile(suffix='.txt', delete=False).name
+    props = {'logFile': log_file, 'consoleLogLevel': LOG_LEVEL.CRITICAL.value}
+
+    metrics = RunMetrics()
+    started = perf_counter()
+    sync_data.run_connection(conn, 'benchmark', props, args, metrics)
+    seconds = perf_counter() - started
+    os.remove(log_file)
+
+    print(json.dumps({
+        'seconds': seconds,
+        'records': sum(stats['records'] for stats in metrics.totals.values()),
+        # On Linux the peak resident set size is reported in kilobytes
+        'peakRssMb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }))
+
+
+def run_scenario(server, scenario):
+    server.reset_counters()
+    child = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.run_benchmarks', '--child', json.dumps(scenario)],
+        stdout=subprocess.PIPE, universal_newlines=True, check=True)
+    result = json.loads(child.stdout.strip().splitlines()[-1])
+    result.update(server.counters)
+    result['recordsPerSecond'] = result['records'] / result['seconds']
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the integration against a mock Aava-API')
+    parser.add_argument('--sizes', default='1000,10000,100000',
+                        help='Comma separated numbers of employees, e.g. 1000,1000000')
+    parser.add_argument('--modes', default=','.join(MODES),
+                        help='Comma separated upload modes: ' + ', '.join(MODES))
+    parser.add_argument('--adapters', default=','.join(ADAPTERS),
+                        help='Comma separated source adapters: ' + ', '.join(ADAPTERS))
+    parser.add_argument('--latency', type=float, default=0.01,
+                        help='Delay of each response in seconds')
+    parser.add_argument('--processing-delay', type=float, default=0.2,
+                        help='Time each import is processed in seconds')
+    parser.add_argument('--per-record-delay', type=float, default=0.00001,
+                        help='Additional processing time per record in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Share of requests failing with HTTP 503')
+    parser.add_argument('--output', help='Also write the results to this file as JSON lines')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    options = parser.parse_args()
+
+    if options.child:
+        run_child(json.loads(options.child))
+        return
+
+    server = MockAavaServer(latency=options.latency,
+                            processing_delay=options.processing_delay,
+                            per_record_delay=options.per_record_delay,
+                            error_rate=options.error_rate).start()
+
+    row = '{:>9} {:>10} {:>10} {:>9} {:>12} {:>10} {:>8} {:>8} {:>7}'
+    print(row.format('size', 'adapter', 'mode', 'seconds', 'records/s', 'peak MB',
+                     'imports', 'statuses', 'errors'))
+    try:
+        for size in [int(size) for size in options.sizes.split(',')]:
+            for adapter in options.adapters.split(','):
+                for mode in options.modes.split(','):
+                    scenario = {'size': size, 'adapter': adapter, 'mode': mode, 'server': server.url}
+                    result = run_scenario(server, scenario)
+                    print(row.format(size, adapter, mode,
+                                     '{:.2f}'.format(result['seconds']),
+                                     '{:.0f}'.format(result['recordsPerSecond']),
+                                     '{:.1f}'.format(result['peakRssMb']),
+                                     result['importRequests'], result['statusRequests'],
+                                     result['errors']))
+                    if options.output:
+                        with open(options.output, 'a') as output:
+                            output.write(json.dumps(dict(scenario, **result)) + '\n')
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+from datetime import date, timedelta
+
+# A source module generating any number of realistic looking records. The
+# records are always the same for the same properties, and they are generated
+# lazily unless 'materialize' is set, in which case lists are returned like
+# most source modules do.
+#
+# Properties used (in both hrMgmtSystem and hourTrackingSystem sections):
+#   employees (int): Number of employees, default 1000
+#   departments (int): Number of departments, default one per 50 employees
+#   absencesPerEmployee (int): Number of absences of each employee, default 2
+#   materialize (bool): Return lists instead of generators, default false
+
+FIRST_NAMES = ['Aino', 'Eino', 'Helmi', 'Juho', 'Kerttu', 'Lauri', 'Maija', 'Onni', 'Siiri', 'Väinö']
+LAST_NAMES = ['Hokkanen', 'Eriksson', 'Nissilä', 'Virtanen', 'Korhonen', 'Mäkinen', 'Laine', 'Heikkinen']
+START = date(2010, 1, 1)
+
+
+def result(props, records):
+    return list(records) if props.get('materialize') else records
+
+
+def employee_count(props):
+    return props.get('employees', 1000)
+
+
+def department_count(props):
+    return props.get('departments', max(1, employee_count(props) // 50))
+
+
+def generate_departments(props):
+    for index in range(department_count(props)):
+        yield {
+            'externalId': 'dep{}'.format(index),
+            'names': {
+                'fi': 'Osasto {}'.format(index),
+                'en': 'Department {}'.format(index)
+            }
+        }
+
+
+def generate_personnel(props):
+    departments = department_count(props)
+    for index in range(employee_count(props)):
+        start = START + timedelta(days=index % 3000)
+        employee = {
+            'externalId': 'emp{}'.format(index),
+            'identifier': 'emp{}'.format(index),
+            'callName': FIRST_NAMES[index % len(FIRST_NAMES)],
+            'lastName': LAST_NAMES[index % len(LAST_NAMES)],
+            'emailAddress': 'emp{}@company.com'.format(index),
+            'localPhoneNumber': '010{:07d}'.format(index % 10000000),
+            'startDate': start.isoformat(),
+            'departments': [{
+                'externalId': 'dep{}'.format(index % departments),
+                'startDate': start.isoformat()
+            }]
+        }
+        if index > 0:
+            employee['supervisors'] = [{
+                'externalId': 'emp{}'.format(index // 10),
+                'startDate': start.isoformat()
+            }]
+        yield employee
+
+
+def generate_absences(props):
+    per_employee = props.get('absencesPerEmployee', 2)
+    for index in range(employee_count(props)):
+        for number in range(per_employee):
+            start = START + timedelta(days=(index + number * 37) % 3650)
+            yield {
+                'externalId': 'emp{}'.format(index),
+                'startDate': start.isoformat(),
+                'endDate': (start + timedelta(days=number % 5)).isoformat()
+            }
+
+
+def get_departments(props):
+    return result(props, generate_departments(props))
+
+
+def get_cost_centers(props):
+    return []
+
+
+def get_personnel(props):
+    return result(props, generate_personnel(props))
+
+
+def get_absences(props):
+    return result(props, generate_absences(props))
@@ -0,0 +1,161 @@
+import json
+import sqlite3
+import threading
+from hashlib import sha1
+
+DEFAULT_CHECKPOINT_FILE = 'checkpoint.sqlite'
+
+
+class CheckpointJournal:
+    """Records the batches sent during a run in an SQLite file, with their
+    message IDs and final statuses, so that an interrupted run can be resumed.
+
+    When resuming, a batch identical to one sent earlier is not sent again:
+    if its import was finished successfully, its recorded status is used, and
+    if it was still in progress, its status is polled. Only batches that failed
+    or were never sent are sent. An import type whose all batches were sent
+    and finished successfully is skipped altogether.
+
+    Args:
+        filename (str): Path to the SQLite file
+        resume (bool): Whether the batches recorded by the previous run are
+            used; if not, the batches of each connection are removed when the
+            connection is imported, and those of other connections are kept
+    """
+
+    def __init__(self, filename, resume=False):
+        self.lock = threading.Lock()
+        self.resume = resume
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS batches (
+                connection TEXT NOT NULL,
+                import_type TEXT NOT NULL,
+                batch_hash TEXT NOT NULL,
+                message_id TEXT NOT NULL,
+                import_status TEXT,
+                status TEXT,
+                batch_index INTEGER,
+                record_count INTEGER,
+                PRIMARY KEY (connection, import_type, batch_hash)
+            )
+        """)
+        # Journals written before the batch positions were recorded
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(batches)")]
+        for column in ['batch_index', 'record_count']:
+            if column not in columns:
+                self.db.execute("ALTER TABLE batches ADD COLUMN {} INTEGER".format(column))
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS batches_message_id ON batches (message_id)")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS imports (
+                connection TEXT NOT NULL,
+                import_type TEXT NOT NULL,
+                PRIMARY KEY (connection, import_type)
+            )
+        """)
+        self.db.commit()
+
+    def connection(self, conn_name):
+        """Returns the part of the journal concerning one connection of this run.
+
+        Args:
+            conn_name (str): Name of the connection
+        """
+        if not self.resume:
+            self.execute("DELETE FROM batches WHERE connection = ?", (conn_name,))
+            self.execute("DELETE FROM imports WHERE connection = ?", (conn_name,))
+        return ConnectionJournal(self, conn_name)
+
+    def execute(self, sql, parameters=()):
+        with self.lock:
+            rows = self.db.execute(sql, parameters).fetchall()
+            self.db.commit()
+            return rows
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+class ConnectionJournal:
+    """The part of the checkpoint journal concerning one connection."""
+
+    def __init__(self, journal, conn_name):
+        self.journal = journal
+        self.conn_name = conn_name
+
+    def completed(self, import_type):
+        """Returns whether all the batches of the import type were sent and
+        finished successfully by the previous run."""
+        submitted = self.journal.execute(
+            "SELECT 1 FROM imports WHERE connection = ? AND import_type = ?",
+            (self.conn_name, import_type))
+        unfinished = self.journal.execute(
+            """SELECT 1 FROM batches WHERE connection = ? AND import_type = ?
+               AND (import_status IS NULL OR import_status != 'DONE')""",
+            (self.conn_name, import_type))
+        return bool(submitted) and not unfinished
+
+    def batch_hash(self, payload):
+        digest = sha1()
+        for part in payload:
+            digest.update(part)
+        return digest.hexdigest()
+
+    def previous_batch(self, import_type, batch_hash):
+        """Returns the message ID and the final status (None if not finished) of
+        an identical batch sent earlier, or None if it must be sent (again)."""
+        rows = self.journal.execute(
+            """SELECT message_id, import_status, status FROM batches
+               WHERE connection = ? AND import_type = ? AND batch_hash = ?""",
+            (self.conn_name, import_type, batch_hash))
+        if not rows or rows[0][1] == 'FAILURE':
+            return None
+        msg_id, import_status, status = rows[0]
+        if import_status == 'DONE':
+            return msg_id, json.loads(status)
+        return msg_id, None
+
+    def sent_batch(self, import_type, batch_hash, msg_id, index=None, count=None):
+        self.journal.execute(
+            """INSERT OR REPLACE INTO batches
+               (connection, import_type, batch_hash, message_id, batch_index, record_count)
+               VALUES (?, ?, ?, ?, ?, ?)""",
+            (self.conn_name, import_type, batch_hash, msg_id, index, count))
+
+    def batch_counts(self, import_type):
+        """Returns the numbers of records in the batches of the import type sent
+        by the previous run, in order, so that the records can be split into the
+        same batches again when the batch sizes vary."""
+        rows = self.journal.execute(
+            """SELECT batch_index, record_count FROM batches
+               WHERE connection = ? AND import_type = ? AND batch_index IS NOT NULL""",
+            (self.conn_name, import_type))
+        counts = dict(rows)
+        # Batches that were never sent end the known sequence
+        sequence = []
+        while len(sequence) in counts:
+            sequence.append(counts[len(sequence)])
+        return sequence
+
+    def submitted(self, import_type):
+        """Marks all the batches of the import type sent."""
+        self.journal.execute(
+            "INSERT OR REPLACE INTO imports (connection, import_type) VALUES (?, ?)",
+            (self.conn_name, import_type))
+
+    def finished(self, statuses):
+        """Records the final statuses of imports. Imports that timed out are
+        left unfinished, so that they are polled again when resuming.
+
+        Args:
+            statuses (list): Status objects of finished imports
+        """
+        for status in statuses:
+            if status['importStatus'] == 'TIMEOUT':
+                continue
+            self.journal.execute(
+                """UPDATE batches SET import_status = ?, status = ?
+                   WHERE connection = ? AND message_id = ?""",
+                (status['importStatus'], json.dumps(status), self.conn_name, status['messageId']))
@@ -1,6 +1,17 @@
 from openpyxl import load_workbook
 
 
+def read_rows(filename):
+    # The workbook is opened in read-only mode, in which the rows are parsed
+    # from the file as they are iterated instead of loading the whole sheet
+    wb = load_workbook(filename, read_only=True)
+    try:
+        for row in wb.active.iter_rows(min_row=2, values_only=True):
+            yield row
+    finally:
+        wb.close()
+
+
 def get_departments(props):
     try:
         assert props['departmentsFile'] != None, 'HRM Departments Excel file not set'
@@ -8,26 +19,25 @@ def get_departments(props):
         print("Properties file not complete:", repr(ex))
         exit()
 
-    wb = load_workbook(props['departmentsFile'])
+    return generate_departments(props['departmentsFile'])
+
 
-    departments = []
-    for row in wb.active.iter_rows(min_row=2):
+def generate_departments(filename):
+    for row in read_rows(filename):
         external_id, fi, sv, en = row
         dep = {
-            'externalId': external_id.value,
+            'externalId': external_id,
             'names': {
             }
         }
-        if row[1].value:
-            dep['names']['fi'] = fi.value
-        if row[2].value:
-            dep['names']['sv'] = sv.value
-        if row[3].value:
-            dep['names']['en'] = en.value
+        if fi:
+            dep['names']['fi'] = fi
+        if sv:
+            dep['names']['sv'] = sv
+        if en:
+            dep['names']['en'] = en
 
-        departments.append(dep)
-
-    return departments
+        yield dep
 
 
 def get_cost_centers(props):
@@ -43,38 +53,37 @@ def get_personnel(props):
         print("Properties file not complete:", repr(ex))
         exit()
 
-    wb = load_workbook(props['employeeFile'])
+    return generate_personnel(props['employeeFile'])
+
 
-    employees = []
-    for row in wb.active.iter_rows(min_row=2):
+def generate_personnel(filename):
+    for row in read_rows(filename):
         external_id, identifier, ssn, call_name, last_name, email_address, private_email_address, \
             job_title, local_phone_number, phone_country_code, start_date, end_date, department, department_start, \
             supervisor, supervisor_start = row
 
         employee = {
-            'externalId': external_id.value,
-            'identifier': identifier.value,
-            'ssn': ssn.value,
-            'callName': call_name.value,
-            'lastName': last_name.value,
-            'emailAddress': email_address.value,
-            'privateEmailAddress': private_email_address.value,
-            'jobTitle': job_title.value,
-            'localPhoneNumber': local_phone_number.value,
-            'phoneCountryCode': phone_country_code.value,
-            'startDate': start_date.value.strftime('%Y-%m-%d'),
+            'externalId': external_id,
+            'identifier': identifier,
+            'ssn': ssn,
+            'callName': call_name,
+            'lastName': last_name,
+            'emailAddress': email_address,
+            'privateEmailAddress': private_email_address,
+            'jobTitle': job_title,
+            'localPhoneNumber': local_phone_number,
+            'phoneCountryCode': phone_country_code,
+            'startDate': start_date.strftime('%Y-%m-%d'),
             'departments': [{
-                'externalId': department.value,
-                'startDate': department_start.value.strftime('%Y-%m-%d'),
+                'externalId': department,
+                'startDate': department_start.strftime('%Y-%m-%d'),
             }]
         }
-        if end_date.value:
-            employee['endDate'] = end_date.value.strftime('%Y-%m-%d')
-        if supervisor.value and supervisor_start.value:
+        if end_date:
+            employee['endDate'] = end_date.strftime('%Y-%m-%d')
+        if supervisor and supervisor_start:
             employee['supervisors'] = [{
-                'externalId': supervisor.value,
-                'startDate': supervisor_start.value.strftime('%Y-%m-%d')
+                'externalId': supervisor,
+                'startDate': supervisor_start.strftime('%Y-%m-%d')
             }]
-        employees.append(employee)
-
-    return employees
+        yield employee
@@ -9,19 +9,24 @@ def get_absences(props):
         print("Properties file not complete:", repr(ex))
         exit()
 
-    wb = load_workbook(props['absenceFile'])
+    return generate_absences(props['absenceFile'])
 
-    absences = []
-    for row in wb.active.iter_rows(min_row=2):
-        external_id, start_date, end_date, approval_type = row
-        absence = {
-            'externalId': external_id.value,
-            'startDate': start_date.value.strftime('%Y-%m-%d')
-        }
-        if end_date.value:
-            absence['endDate'] = end_date.value.strftime('%Y-%m-%d')
-        if approval_type.value:
-            absence['approvalType'] = approval_type.value
-        absences.append(absence)
 
-    return absences
+def generate_absences(filename):
+    # The workbook is opened in read-only mode, in which the rows are parsed
+    # from the file as they are iterated instead of loading the whole sheet
+    wb = load_workbook(filename, read_only=True)
+    try:
+        for row in wb.active.iter_rows(min_row=2, values_only=True):
+            external_id, start_date, end_date, approval_type = row
+            absence = {
+                'externalId': external_id,
+                'startDate': start_date.strftime('%Y-%m-%d')
+            }
+            if end_date:
+                absence['endDate'] = end_date.strftime('%Y-%m-%d')
+            if approval_type:
+                absence['approvalType'] = approval_type
+            yield absence
+    finally:
+        wb.close()
@@ -1,13 +1,53 @@
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import requests
-from requests.auth import HTTPBasicAuth
+from requests.adapters import HTTPAdapter
 from hashlib import md5
 
+from record_store import RecordStore
+
+# The employees are read from the REST API in pages of this many rows, with
+# this many pages being fetched at the same time. Both can be overridden with
+# properties 'pageSize' and 'fetchThreads'.
+PAGE_SIZE = 500
+FETCH_THREADS = 4
+
 # In this implementation it is assumed, that SympaHR has no separate
 # method for querying only the department info. To avoid doubling the
-# REST request, we are using a global parameter to store the fetched
-# data for the duration of the run
-deps = {}
-employees = []
+# REST request, the fetched data is stored until the import of the
+# connection is finished and release() is called. The data is kept
+# separately for each connection, so that connections run in parallel or
+# one after another do not see each other's employees.
+cache = {}
+cache_locks = {}
+cache_lock = threading.Lock()
+
+
+def cache_key(props):
+    # The properties section is a separate object for each connection
+    return id(props)
+
+
+def get_cached(props):
+    key = cache_key(props)
+    with cache_lock:
+        connection_lock = cache_locks.setdefault(key, threading.Lock())
+
+    # Only one thread loads the data of a connection, others wait for it
+    with connection_lock:
+        if key not in cache:
+            cache[key] = load_sympa(props)
+        return cache[key]
+
+
+def release(props):
+    """Called by sync_data when the import of the connection is finished,
+    so that the employees are not kept in memory for the rest of the run."""
+    key = cache_key(props)
+    with cache_lock:
+        cache.pop(key, None)
+        cache_locks.pop(key, None)
 
 
 def get_depId(department_name):
@@ -16,7 +56,7 @@ def get_depId(department_name):
     return md5(department_name.encode("UTF-8")).hexdigest()[0:15]
 
 
-def load_sympa(props):
+def check_props(props):
     try:
         assert props['moduleName'] != None, 'HRM module name not set'
         assert props['url'] != None, 'HRM URL not set'
@@ -26,89 +66,173 @@ def load_sympa(props):
         print("Properties file not complete:", repr(ex))
         exit()
 
-    # Load all the information for use by the other two functions
-    response = requests.get(
-        props['url'],
-        auth=(props['id'],
-              props['pw'])
-    )
 
+def new_session(props):
+    # The connections are kept alive and reused by the threads fetching pages
+    session = requests.Session()
+    session.auth = (props['id'], props['pw'])
+    adapter = HTTPAdapter(pool_maxsize=props.get('fetchThreads', FETCH_THREADS))
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def fetch_page(session, url, params):
+    response = session.get(url, params=params)
     if not response:
         print("Could not read employee info")
         print(response.content)
         exit()
+    return response.json()
 
-    errors = []
-    for e in response.json()["value"]:
-        # Not all employees are created perfect
+
+def fetch_pages(props):
+    """Reads the employee rows from SympaHR one page at a time using the
+    OData parameters $top and $skip. If the API tells the total number of rows,
+    the rest of the pages are fetched concurrently, a few pages ahead of the
+    ones being processed.
+
+    Yields:
+        list: The employee rows of each page, in order
+    """
+    url = props['url']
+    page_size = props.get('pageSize', PAGE_SIZE)
+    threads = props.get('fetchThreads', FETCH_THREADS)
+
+    with new_session(props) as session:
+        page = fetch_page(session, url, {'$top': page_size, '$skip': 0, '$count': 'true'})
+        yield page['value']
+
+        # A server not supporting paging returns everything at once
+        if len(page['value']) != page_size:
+            return
+
+        total = page.get('@odata.count')
+        if total is None:
+            # The number of pages is not known, so they are read one by one
+            skip = page_size
+            while page.get('@odata.nextLink') or len(page['value']) == page_size:
+                if page.get('@odata.nextLink'):
+                    page = fetch_page(session, page['@odata.nextLink'], None)
+                else:
+                    page = fetch_page(session, url, {'$top': page_size, '$skip': skip})
+                    skip += page_size
+                yield page['value']
+            return
+
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            skips = iter(range(page_size, total, page_size))
+            futures = deque()
+            for skip in skips:
+                futures.append(executor.submit(
+                    fetch_page, session, url, {'$top': page_size, '$skip': skip}))
+                if len(futures) >= 2 * threads:
+                    break
+            while futures:
+                rows = futures.popleft().result()['value']
+                skip = next(skips, None)
+                if skip is not None:
+                    futures.append(executor.submit(
+                        fetch_page, session, url, {'$top': page_size, '$skip': skip}))
+                yield rows
+
+
+def parse_employee(e, deps, errors):
+    """Converts an employee row of SympaHR into an employee record, adding the
+    departments of the employee into 'deps' and any problems in 'errors'.
+
+    Returns:
+        dict: The employee, or None if the row is not complete
+    """
+    # Not all employees are created perfect
+    try:
+        assert e["Henkilönumero"] != None
+        assert e["Henkilötunnus"] != None
+        assert len(e["Työsuhdetiedot"]) > 0
+    except Exception as ex:
+        errors.append(repr(ex))
+        return None
+
+    e["Etunimet"] = ' '.join(
+        map(lambda x: x.capitalize(), e["Etunimet"].split(' '))
+    )
+
+    # Initialize the dictionary with information we trust to
+    # always be available
+    employee = {
+        'externalId': e["Henkilönumero"],
+        'identifier': e["Henkilönumero"],
+        'ssn': e["Henkilötunnus"],
+        'callName': e["Etunimet"].split(' ')[0],
+        'lastName': e["Sukunimi"],
+        'emailAddress': e["Työsähköposti"],
+        'localPhoneNumber': e["Puhelinnumero_työ"],
+        'startDate': e["Työsuhdetiedot"][0]["Työsuhteen_alkupvm"],
+        'departments': []
+    }
+
+    # Add employment end date, if set
+    if e["Työsuhdetiedot"][0]["Työsuhteen_päättymispvm"]:
+        employee['endDate'] = e["Työsuhdetiedot"][0]["Työsuhteen_päättymispvm"]
+
+    # Add supervisor information, if available
+    if e["Lähin_esimies"]:
+        employee['supervisors'] = [{
+            'externalId': e["Lähin_esimies"],
+            'startDate': e["Työsuhdetiedot"][0]["Työsuhteen_alkupvm"]
+        }]
+
+    # Add information of past and current departments
+    for d in e["Työsuhdetiedot"]:
         try:
-            assert e["Henkilönumero"] != None
-            assert e["Henkilötunnus"] != None
-            assert len(e["Työsuhdetiedot"]) > 0
+            assert d["Osasto"] != None
         except Exception as ex:
             errors.append(repr(ex))
             continue
 
-        e["Etunimet"] = ' '.join(
-            map(lambda x: x.capitalize(), e["Etunimet"].split(' '))
-        )
-
-        # Initialize the dictionary with information we trust to
-        # always be available
-        employee = {
-            'externalId': e["Henkilönumero"],
-            'identifier': e["Henkilönumero"],
-            'ssn': e["Henkilötunnus"],
-            'callName': e["Etunimet"].split(' ')[0],
-            'lastName': e["Sukunimi"],
-            'emailAddress': e["Työsähköposti"],
-            'localPhoneNumber': e["Puhelinnumero_työ"],
-            'startDate': e["Työsuhdetiedot"][0]["Työsuhteen_alkupvm"],
-            'departments': []
-        }
-
-        # Add employment end date, if set
-        if e["Työsuhdetiedot"][0]["Työsuhteen_päättymispvm"]:
-            employee['endDate'] = e["Työsuhdetiedot"][0]["Työsuhteen_päättymispvm"]
+        d_id = get_depId(d["Osasto"])
 
-        # Add supervisor information, if available
-        if e["Lähin_esimies"]:
-            employee['supervisors'] = [{
-                'externalId': e["Lähin_esimies"],
-                'startDate': e["Työsuhdetiedot"][0]["Työsuhteen_alkupvm"]
-            }]
+        # make sure the department info is in the deps array
+        deps[d_id] = d["Osasto"]
 
-        # Add information of past and current departments
-        for d in e["Työsuhdetiedot"]:
-            try:
-                assert d["Osasto"] != None
-            except Exception as ex:
-                errors.append(repr(ex))
-                continue
-
-            d_id = get_depId(d["Osasto"])
+        d_info = {
+            'externalId': d_id,
+            'startDate': d["Rivi_voimassa_alkaen_pvm"]
+        }
+        if d["Rivi_voimassa_asti_pvm"] != None:
+            d_info['endDate'] = d["Rivi_voimassa_asti_pvm"]
 
-            # make sure the department info is in the deps array
-            deps[d_id] = d["Osasto"]
+        employee['departments'].append(d_info)
 
-            d_info = {
-                'externalId': d_id,
-                'startDate': d["Rivi_voimassa_alkaen_pvm"]
-            }
-            if d["Rivi_voimassa_asti_pvm"] != None:
-                d_info['endDate'] = d["Rivi_voimassa_asti_pvm"]
+    return employee
 
-            employee['departments'].append(d_info)
 
-        employees.append(employee)
+def generate_personnel(props, deps):
+    """Yields the employees as the pages are read from SympaHR, collecting
+    their departments into 'deps'."""
+    errors = []
+    for rows in fetch_pages(props):
+        for e in rows:
+            employee = parse_employee(e, deps, errors)
+            if employee:
+                yield employee
 
     if len(errors) > 0:
         print("Found {} errors when loading employee data.".format(len(errors)))
 
 
+def load_sympa(props):
+    # Load all the information for use by the other two functions
+    check_props(props)
+    deps = {}
+    # The employees are kept in a compact store instead of a list of dicts,
+    # as there may be a lot of them with their department histories
+    employees = RecordStore('employee', generate_personnel(props, deps))
+    return deps, employees
+
+
 def get_departments(props):
-    if len(deps) == 0:
-        load_sympa(props)
+    deps, _ = get_cached(props)
     departments = []
     for key in deps:
         departments.append({
@@ -124,6 +248,12 @@ def get_cost_centers(props):
 
 
 def get_personnel(props):
-    if len(employees) == 0:
-        load_sympa(props)
-    return employees
+    # If the departments were not imported, there is nothing cached, and the
+    # employees can be sent as they are read
+    with cache_lock:
+        cached = cache.get(cache_key(props))
+    if cached:
+        _, employees = cached
+        return employees
+    check_props(props)
+    return generate_personnel(props, {})
@@ -1,9 +1,29 @@
-import os
+import atexit
+import codecs
 import csv
+import json
+import threading
 import pysftp
 import paramiko
 from base64 import decodebytes
 
+# The CSV file is read from the server in chunks of this many bytes, unless
+# property 'chunkSize' is set
+CHUNK_SIZE = 32 * 1024
+
+# The SFTP sessions are kept open for the duration of the run and shared by
+# all the connections reading files from the same server as the same user
+sessions = {}
+sessions_lock = threading.Lock()
+
+# With property 'skipUnchanged', the modification time and size of the file
+# are stored here and the file is not read again until they change. They are
+# stored only once the absences read from the file have been imported, so
+# until then they are kept for each connection: id(props) -> (file, key, state)
+DEFAULT_STATE_FILE = 'timeplan-state.json'
+state_lock = threading.Lock()
+read_states = {}
+
 
 def parse_date(datestring):
     # Timeplan return the date in format "dd-mm-yy"
@@ -12,7 +32,7 @@ def parse_date(datestring):
     return '{}-{}-{}'.format(year, month, day)
 
 
-def get_absences(props):
+def check_props(props):
     try:
         assert props != None, 'No hourTrackingSystem properties section'
         assert props['moduleName'] != None, 'Time tracking module name not set'
@@ -26,35 +46,135 @@ def get_absences(props):
         print("Properties file not complete:", repr(ex))
         exit()
 
-    absences = []
-
-    # For added security, the server's hostkey is verified against the one stored in properties
-    bHostKey = str.encode(props['hostKey'])
-    hostKey = paramiko.DSSKey(data=decodebytes(bHostKey))
-    cnopts = pysftp.CnOpts()
-    cnopts.hostkeys.add(props['host'],
-                        'ssh-rsa',
-                        hostKey)
-
-    tempfile = '__temp.csv'
-
-    with pysftp.Connection(host=props['host'],
-                           username=props['id'],
-                           password=props['pw'],
-                           cnopts=cnopts) as sftp:
-        sftp.get(props['path'], tempfile)
-
-    csvfile = open(tempfile, 'r')
-    reader = csv.reader(csvfile, delimiter=';')
-    for row in reader:
-        external_id, start_date, end_date = row
-        absence = {
-            'externalId': external_id,
-            'startDate': parse_date(start_date),
-            'endDate': parse_date(end_date)
-        }
-        absences.append(absence)
-
-    os.remove(tempfile)
-
-    return absences
+
+def is_open(sftp):
+    transport = sftp.sftp_client.get_channel().get_transport()
+    return transport is not None and transport.is_active()
+
+
+def get_session(props):
+    key = (props['host'], props['port'], props['id'])
+    with sessions_lock:
+        sftp = sessions.get(key)
+        if sftp is not None and not is_open(sftp):
+            sftp.close()
+            sftp = None
+
+        if sftp is None:
+            # For added security, the server's hostkey is verified against the one stored in properties
+            bHostKey = str.encode(props['hostKey'])
+            hostKey = paramiko.DSSKey(data=decodebytes(bHostKey))
+            cnopts = pysftp.CnOpts()
+            cnopts.hostkeys.add(props['host'],
+                                'ssh-rsa',
+                                hostKey)
+
+            sftp = pysftp.Connection(host=props['host'],
+                                     port=props['port'],
+                                     username=props['id'],
+                                     password=props['pw'],
+                                     cnopts=cnopts)
+            sessions[key] = sftp
+        return sftp
+
+
+@atexit.register
+def close_sessions():
+    with sessions_lock:
+        for sftp in sessions.values():
+            sftp.close()
+        sessions.clear()
+
+
+def load_state(filename):
+    try:
+        with open(filename, 'r') as state_file:
+            return json.load(state_file)
+    except FileNotFoundError:
+        return {}
+
+
+def save_state(filename, key, value):
+    with state_lock:
+        state = load_state(filename)
+        state[key] = value
+        with open(filename, 'w') as state_file:
+            json.dump(state, state_file)
+
+
+def read_lines(remote_file, chunk_size, encoding):
+    """Reads a remote file in chunks and yields it line by line, so that the
+    file is parsed as it is downloaded instead of being saved first."""
+    decoder = codecs.getincrementaldecoder(encoding)()
+    pending = ''
+    while True:
+        chunk = remote_file.read(chunk_size)
+        pending += decoder.decode(chunk, final=not chunk)
+        lines = pending.splitlines(keepends=True)
+        if chunk and lines and not lines[-1].endswith('\n'):
+            # The last line continues in the next chunk
+            pending = lines.pop()
+        else:
+            pending = ''
+        yield from lines
+        if not chunk:
+            return
+
+
+def generate_absences(props, state_file=None, state_key=None, state=None):
+    sftp = get_session(props)
+    chunk_size = props.get('chunkSize', CHUNK_SIZE)
+    with sftp.open(props['path'], 'rb', bufsize=chunk_size) as remote_file:
+        # Requests the rest of the file in the background while it is parsed
+        remote_file.prefetch()
+        lines = read_lines(remote_file, chunk_size, props.get('encoding', 'utf-8'))
+        reader = csv.reader(lines, delimiter=';')
+        for row in reader:
+            if not row:
+                continue
+            external_id, start_date, end_date = row
+            absence = {
+                'externalId': external_id,
+                'startDate': parse_date(start_date),
+                'endDate': parse_date(end_date)
+            }
+            yield absence
+
+    # The file has been read through, so it need not be read again until it
+    # changes, once the absences have been imported
+    if state_file:
+        with state_lock:
+            read_states[id(props)] = (state_file, state_key, state)
+
+
+def get_absences(props):
+    check_props(props)
+
+    if not props.get('skipUnchanged'):
+        return generate_absences(props)
+
+    stat = get_session(props).stat(props['path'])
+    state_file = props.get('stateFile', DEFAULT_STATE_FILE)
+    state_key = '{}:{}'.format(props['host'], props['path'])
+    state = [stat.st_mtime, stat.st_size]
+    if load_state(state_file).get(state_key) == state:
+        print("Absence file {} has not changed, skipping".format(props['path']))
+        return None
+
+    return generate_absences(props, state_file, state_key, state)
+
+
+def imported(props, import_type):
+    # Called when the absences have been imported successfully
+    if import_type != 'absence':
+        return
+    with state_lock:
+        read_state = read_states.pop(id(props), None)
+    if read_state:
+        save_state(*read_state)
+
+
+def release(props):
+    # If the import was not finished successfully, the file is read again next time
+    with state_lock:
+        read_states.pop(id(props), None)
@@ -0,0 +1,106 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Request bodies are written to the socket in blocks of about this size
+BLOCK_SIZE = 64 * 1024
+
+
+class StdlibSerializer:
+    """Serializes with the json module of the standard library. Non-ASCII
+    characters are escaped, so the encoded strings are plain ASCII."""
+
+    name = "json"
+
+    def dumps(self, obj) -> bytes:
+        return json.dumps(obj).encode("ascii")
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+class OrjsonSerializer:
+    """Serializes with orjson, which produces UTF-8 encoded bytes directly and
+    is several times faster than the json module with large payloads."""
+
+    name = "orjson"
+
+    def dumps(self, obj) -> bytes:
+        return orjson.dumps(obj)
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+
+SERIALIZERS = {"json": StdlibSerializer}
+if orjson is not None:
+    SERIALIZERS["orjson"] = OrjsonSerializer
+
+
+def get_serializer(parameters: dict):
+    """
+    Returns the JSON serializer chosen by the optional connection parameter
+    'jsonSerializer': "json" for the standard library or "orjson". By default
+    orjson is used if it is installed.
+
+    Args:
+        parameters (dict): Parameters of the connection
+
+    Raises:
+        ValueError: If the serializer is unknown or not installed
+
+    Returns:
+        StdlibSerializer | OrjsonSerializer: The serializer
+    """
+    name = parameters.get("jsonSerializer") or ("orjson" if orjson is not None else "json")
+    if name not in SERIALIZERS:
+        raise ValueError(f"JSON serializer '{name}' is not available")
+    return SERIALIZERS[name]()
+
+
+def body_parts(payload) -> list:
+    """
+    Returns a request payload as a list of byte strings, which are sent one after
+    another without joining them first.
+
+    Args:
+        payload (str | bytes | list): The payload, or the parts of it as bytes
+    """
+    if isinstance(payload, str):
+        return [payload.encode("utf-8")]
+    if isinstance(payload, (bytes, bytearray)):
+        return [payload]
+    return payload
+
+
+def body_size(parts: list) -> int:
+    return sum(len(part) for part in parts)
+
+
+def body_blocks(parts: list, block_size: int = BLOCK_SIZE):
+    """
+    Groups the parts of a request body into blocks of about 'block_size' bytes,
+    so that a body made of many small records is written with few system calls
+    and without a copy of the whole body in memory.
+
+    Args:
+        parts (list): The parts of the body as bytes
+        block_size (int): Minimum size of a block, except for the last one
+
+    Yields:
+        bytes: The blocks of the body
+    """
+    block = []
+    size = 0
+    for part in parts:
+        block.append(part)
+        size += len(part)
+        if size >= block_size:
+            yield b"".join(block)
+            block = []
+            size = 0
+    if block:
+        yield b"".join(block)
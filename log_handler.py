@@ -1,5 +1,10 @@
+import atexit
+import sys
+import threading
 from datetime import datetime
 from enum import Enum
+from queue import Queue, Empty
+from time import monotonic, time
 
 
 class LOG_LEVEL(Enum):
@@ -10,64 +15,257 @@ class LOG_LEVEL(Enum):
     CRITICAL = 4
 
 
-CURRENT_LOG_FILE = 'execution_log.txt'
-CURRENT_LOG_LEVEL = LOG_LEVEL.NOTICE.value
+DEFAULT_LOG_FILE = 'execution_log.txt'
+DEFAULT_LOG_LEVEL = LOG_LEVEL.NOTICE.value
+DEFAULT_CONSOLE_LEVEL = LOG_LEVEL.DEBUG.value
+
+# Buffered log lines are written to the files at least this often (seconds)
+# or when this many bytes have been buffered, whichever comes first
+FLUSH_INTERVAL = 1.0
+FLUSH_SIZE = 64 * 1024
+
+
+class LogWriter:
+    """Writes the log lines to the log files in a background thread. Each log
+    file is kept open for the duration of the run, and the lines are written
+    in batches instead of opening and closing the file for every line.
+
+    If a log file cannot be opened or written, the error is reported once on
+    stderr and the lines for that file are dropped, while the other files are
+    still written.
+    """
+
+    def __init__(self, flush_interval=FLUSH_INTERVAL, flush_size=FLUSH_SIZE):
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.queue = Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.files = {}
+        self.failed = set()
+
+        # Formatting the time is relatively slow, so it is done once a second
+        self.formatted_second = None
+        self.formatted_time = None
+
+    def write(self, filename, timestamp, level, message):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name='log-writer', daemon=True)
+                self.thread.start()
+        self.queue.put((filename, timestamp, level, message))
+
+    def flush(self):
+        """Blocks until all the lines written so far are in the files."""
+        with self.lock:
+            thread = self.thread
+            if thread is None:
+                return
+        done = threading.Event()
+        self.queue.put(done)
+        # The thread is not waited for if it has stopped for an unexpected error
+        while not done.wait(self.flush_interval):
+            if not thread.is_alive():
+                return
+
+    def close(self):
+        with self.lock:
+            if self.thread is None:
+                return
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def format_time(self, timestamp):
+        second = int(timestamp)
+        if second != self.formatted_second:
+            self.formatted_second = second
+            self.formatted_time = datetime.fromtimestamp(second).strftime("%d.%m.%Y %H:%M:%S")
+        return self.formatted_time
+
+    def fail(self, filename, error):
+        if filename not in self.failed:
+            self.failed.add(filename)
+            print("Writing to log file {} failed: {}".format(filename, error), file=sys.stderr)
+        lfile = self.files.pop(filename, None)
+        if lfile:
+            try:
+                lfile.close()
+            except Exception:
+                pass
+
+    def write_line(self, filename, line):
+        if filename in self.failed:
+            return
+        try:
+            if filename not in self.files:
+                self.files[filename] = open(filename, 'a', buffering=self.flush_size,
+                                            encoding='utf-8', errors='backslashreplace')
+            self.files[filename].write(line)
+        except Exception as e:
+            self.fail(filename, e)
+
+    def flush_files(self):
+        for filename, lfile in list(self.files.items()):
+            try:
+                lfile.flush()
+            except Exception as e:
+                self.fail(filename, e)
+
+    def run(self):
+        buffered = 0
+        last_flush = monotonic()
+        while True:
+            try:
+                item = self.queue.get(timeout=self.flush_interval)
+            except Empty:
+                item = False
+
+            if isinstance(item, tuple):
+                filename, timestamp, level, message = item
+                line = "\n{}: {:<8} {}".format(self.format_time(timestamp), level.name, message)
+                self.write_line(filename, line)
+                buffered += len(line)
+
+            if item is None or isinstance(item, threading.Event) or buffered >= self.flush_size \
+                    or (buffered and monotonic() - last_flush >= self.flush_interval):
+                self.flush_files()
+                buffered = 0
+                last_flush = monotonic()
+
+            if isinstance(item, threading.Event):
+                item.set()
+            elif item is None:
+                for lfile in self.files.values():
+                    lfile.close()
+                self.files.clear()
+                return
+
+
+class Logger:
+    """The log settings of a connection: where the log is written, and the
+    minimum levels of the messages written in the file and on screen.
+
+    Args:
+        filename (String): The path to the log file
+        level (int): The minimum severity of events to be written in the file
+        console_level (int): The minimum severity of events to be printed on screen
+        prefix (String): A prefix for the messages printed on screen
+    """
+
+    def __init__(self, filename=DEFAULT_LOG_FILE, level=DEFAULT_LOG_LEVEL,
+                 console_level=DEFAULT_CONSOLE_LEVEL, prefix=None):
+        self.filename = filename
+        self.level = level
+        self.console_level = console_level
+        self.prefix = prefix
+
+    def copy(self):
+        return Logger(self.filename, self.level, self.console_level, self.prefix)
+
+    def write(self, level, message):
+        # If run manually, all this may be of interest to the user
+        if level.value >= self.console_level:
+            if self.prefix:
+                message_line = "[{}] {}".format(self.prefix, message)
+            else:
+                message_line = message
+            with CONSOLE_LOCK:
+                print(message_line)
+
+        if level.value >= self.level:
+            WRITER.write(self.filename, time(), level, message)
+
+
+WRITER = LogWriter()
+CONSOLE_LOCK = threading.Lock()
+atexit.register(WRITER.close)
+
+# Each thread has its own logger, so that connections run in parallel can each
+# write to their own log file. Threads that have not set their own settings
+# start with the ones set by the main thread.
+MAIN_LOGGER = Logger()
+THREAD_LOGGER = threading.local()
+
+
+def get_logger():
+    if threading.current_thread() is threading.main_thread():
+        return MAIN_LOGGER
+    if not hasattr(THREAD_LOGGER, 'logger'):
+        THREAD_LOGGER.logger = MAIN_LOGGER.copy()
+    return THREAD_LOGGER.logger
 
 
 def set_log_file(filename):
     """Changes the name of the file where the log is written. This is used
     e.g. if the logs for a specific connection should be written in its own
-    file.
+    file. The setting applies to the current thread.
 
     Args:
         filename (String): The path to the log file
     """
-    global CURRENT_LOG_FILE
-
     if filename:
-        CURRENT_LOG_FILE = filename
+        get_logger().filename = filename
     else:
-        CURRENT_LOG_FILE = 'execution_log.txt'
+        get_logger().filename = DEFAULT_LOG_FILE
 
 
 def get_log_file():
-    global CURRENT_LOG_FILE
-    return CURRENT_LOG_FILE
+    return get_logger().filename
 
 
 def set_log_level(level):
     """Changes the log level used to determine, which events should be logged.
+    The setting applies to the current thread.
 
     Args:
         level (LOG_LEVEL): The minimum severity of events to be written in logs
     """
-    global CURRENT_LOG_LEVEL
-
     if level:
-        CURRENT_LOG_LEVEL = level.value
+        get_logger().level = level.value
     else:
-        CURRENT_LOG_LEVEL = LOG_LEVEL.NOTICE.value
+        get_logger().level = DEFAULT_LOG_LEVEL
 
 
 def get_log_level():
-    global CURRENT_LOG_LEVEL
-    return CURRENT_LOG_LEVEL
+    return get_logger().level
+
+
+def set_console_level(level):
+    """Changes the log level used to determine, which events are printed on
+    screen. The setting applies to the current thread.
+
+    Args:
+        level (LOG_LEVEL): The minimum severity of events to be printed
+    """
+    if level:
+        get_logger().console_level = level.value
+    else:
+        get_logger().console_level = DEFAULT_CONSOLE_LEVEL
+
+
+def set_log_prefix(prefix):
+    """Sets a prefix for the messages printed on screen by the current thread,
+    so that the output of connections run in parallel can be told apart.
+
+    Args:
+        prefix (String): The prefix, e.g. name of the connection
+    """
+    get_logger().prefix = prefix
+
+
+def flush_logs():
+    """Blocks until all the log entries written so far are in the log files."""
+    WRITER.flush()
 
 
 def write_log(level, message):
     """
-    Writes a log entry in the system log
+    Writes a log entry in the system log. The entry is written to the file in
+    the background, see LogWriter.
 
     Args:
         level (LOG_LEVEL): [description]
         message (String): [description]
     """
-
-    # If run manually, all this may be of interest to the user
-    print(message)
-
-    if level.value >= get_log_level():
-        now = datetime.now().strftime("%d.%m.%Y %H:%M:%S")
-        lfile = open(get_log_file(), 'a')
-        lfile.writelines("\n{}: {:<8} {}".format(now, level.name, message))
-        lfile.close()
+    get_logger().write(level, message)
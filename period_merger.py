@@ -0,0 +1,143 @@
+from datetime import date, timedelta
+
+from log_handler import LOG_LEVEL, write_log
+from record_validator import is_date
+
+ONE_DAY = timedelta(days=1)
+
+
+def is_day(value):
+    # Periods with a time in their dates are not merged
+    return is_date(value) and len(value) == 10
+
+
+def group_key(record):
+    """Returns the key of the group of periods that may be merged with the
+    given one: the periods must be equal in all the other fields than the
+    dates, e.g. the employee and approval type of an absence. None is returned
+    if the record cannot be merged with others."""
+    if not isinstance(record, dict) or not is_day(record.get('startDate')):
+        return None
+    end = record.get('endDate')
+    if end is not None and not is_day(end):
+        return None
+    key = tuple(sorted((field, value) for field, value in record.items()
+                       if field not in ['startDate', 'endDate']))
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+def merge_sorted(periods):
+    """Merges the periods of one group, sorted by start date, where they
+    overlap or where one ends the day before the next one starts. A period
+    without end date lasts until further notice.
+
+    Args:
+        periods (list): The periods as dicts with startDate and optional endDate
+
+    Returns:
+        list: The merged periods, new dicts for the ones that were extended
+    """
+    merged = []
+    for period in periods:
+        if merged:
+            last = merged[-1]
+            end = last.get('endDate')
+            if end is None:
+                continue
+            if period['startDate'] <= end or \
+                    date.fromisoformat(period['startDate']) - ONE_DAY <= date.fromisoformat(end):
+                next_end = period.get('endDate')
+                if next_end is None:
+                    merged[-1] = dict(last)
+                    merged[-1].pop('endDate', None)
+                elif next_end > end:
+                    merged[-1] = dict(last, endDate=next_end)
+                continue
+        merged.append(period)
+    return merged
+
+
+def merge_periods(periods):
+    """Merges the overlapping and contiguous periods within each group of
+    otherwise equal periods. The groups are kept in the order of their first
+    period and the periods of a group are sorted by start date.
+
+    Args:
+        periods (iterable): The periods as dicts with startDate and optional endDate
+
+    Returns:
+        list: The merged periods
+    """
+    groups = {}
+    unmerged = []
+    for period in periods:
+        key = group_key(period)
+        if key is None:
+            unmerged.append(period)
+        else:
+            groups.setdefault(key, []).append(period)
+
+    merged = []
+    for group in groups.values():
+        if len(group) > 1:
+            group.sort(key=lambda period: period['startDate'])
+            group = merge_sorted(group)
+        merged.extend(group)
+    return merged + unmerged
+
+
+def merge_absences(absences):
+    """Merges the overlapping, contiguous and duplicate absences of each
+    employee. All the absences are read before the first one is returned, as
+    the absences of an employee may be anywhere in the source.
+
+    Args:
+        absences (iterable): The absences read from the source
+
+    Yields:
+        dict: The merged absences
+    """
+    count = 0
+
+    def counted(records):
+        nonlocal count
+        for record in records:
+            count += 1
+            yield record
+
+    merged = merge_periods(counted(absences))
+    if len(merged) < count:
+        write_log(LOG_LEVEL.NOTICE,
+                  "Merged {} absences into {}".format(count, len(merged)))
+    yield from merged
+
+
+def merge_employee_periods(employees):
+    """Merges the overlapping, contiguous and duplicate department and
+    supervisor periods of each employee.
+
+    Args:
+        employees (iterable): The employees read from the source
+
+    Yields:
+        dict: The employees with merged periods
+    """
+    merged_count = 0
+    for employee in employees:
+        if isinstance(employee, dict):
+            for field in ['departments', 'supervisors']:
+                periods = employee.get(field)
+                if isinstance(periods, list) and len(periods) > 1:
+                    merged = merge_periods(periods)
+                    if len(merged) < len(periods):
+                        employee = dict(employee, **{field: merged})
+                        merged_count += len(periods) - len(merged)
+        yield employee
+
+    if merged_count:
+        write_log(LOG_LEVEL.NOTICE,
+                  "Merged {} department and supervisor periods of employees".format(merged_count))
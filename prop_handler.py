@@ -1,61 +1,254 @@
 import json
+import os
+import re
 import shutil
 
+from json_codec import SERIALIZERS
+from log_handler import LOG_LEVEL
 
-PROPERTIES = None
 
+DEFAULT_PROPERTIES_FILE = 'properties.json'
+TEMPLATE_FILE = 'properties-template.json'
 
-def load_properties() -> dict:
+# The parsed properties of each file, with the modification time and size
+# of the file when it was read: path -> (mtime, size, properties)
+PROPERTIES = {}
+
+# References to environment variables in string values, e.g. "${AAVA_SECRET}"
+ENV_REFERENCE = re.compile(r'\$\{(\w+)\}')
+
+NUMBER = (int, float)
+
+# The values accepted for some of the parameters, as a list of the values or
+# as a condition and its description
+POSITIVE = (lambda value: value > 0, 'greater than 0')
+NOT_NEGATIVE = (lambda value: value >= 0, '0 or greater')
+LOG_LEVELS = [level.value for level in LOG_LEVEL]
+VALIDATION_MODES = ['skip', 'warn', 'off']
+
+# The parameters of a connection: path of the parameter, accepted types,
+# whether the parameter is required and optionally the values accepted
+CONNECTION_SCHEMA = [
+    ('aavaApiServer', str, True),
+    ('clientId', (str, int), True),
+    ('clientSecret', str, True),
+    ('organizationId', (str, int), True),
+    ('hrMgmtSystem', dict, True),
+    ('hrMgmtSystem.moduleName', str, True),
+    ('hourTrackingSystem', dict, True),
+    ('hourTrackingSystem.moduleName', str, True),
+    ('connectionName', str, False),
+    ('batchSize', int, False, POSITIVE),
+    ('batchBytes', int, False, POSITIVE),
+    ('adaptiveBatchSize', bool, False),
+    ('batchTargetSeconds', NUMBER, False, POSITIVE),
+    ('poolSize', int, False, POSITIVE),
+    ('requestTimeout', NUMBER, False, POSITIVE),
+    ('gzipRequests', bool, False),
+    ('jsonSerializer', str, False, list(SERIALIZERS)),
+    ('pollInterval', NUMBER, False, POSITIVE),
+    ('pollMaxInterval', NUMBER, False, POSITIVE),
+    ('pollTimeout', NUMBER, False, POSITIVE),
+    ('maxInFlight', int, False, POSITIVE),
+    ('maxRetries', int, False, NOT_NEGATIVE),
+    ('retryBackoff', NUMBER, False, NOT_NEGATIVE),
+    ('maxRetryBackoff', NUMBER, False, NOT_NEGATIVE),
+    ('retryBudget', int, False, NOT_NEGATIVE),
+    ('logFile', str, False),
+    ('logLevel', int, False, LOG_LEVELS),
+    ('consoleLogLevel', int, False, LOG_LEVELS),
+    ('snapshotFile', str, False),
+    ('validation', str, False, VALIDATION_MODES),
+    ('mergePeriods', bool, False),
+    ('prefetch', bool, False),
+    ('prefetchBuffer', int, False, POSITIVE),
+    ('warningExamples', int, False, NOT_NEGATIVE),
+    ('warningRecords', bool, False),
+]
+
+# The general parameters of the properties file, outside the connections
+PROPERTIES_SCHEMA = [
+    ('logFile', str, False),
+    ('logLevel', int, False, LOG_LEVELS),
+    ('consoleLogLevel', int, False, LOG_LEVELS),
+    ('metricsFile', str, False),
+    ('checkpointFile', str, False),
+    ('batchSizeFile', str, False),
+    ('warningReport', str, False),
+]
+
+
+class PropertiesError(ValueError):
+    """Raised when the properties file cannot be read or is not complete."""
+
+
+def type_names(types):
+    if not isinstance(types, tuple):
+        types = (types,)
+    return ' or '.join({str: 'a string', int: 'an integer', float: 'a number',
+                        bool: 'true or false', dict: 'an object'}[t] for t in types)
+
+
+def compile_check(path, types, required, accepted=None):
+    """Returns a function checking one parameter of a connection, which
+    returns a description of the problem, or None if there is none."""
+    keys = path.split('.')
+    # JSON true and false are read as bool, which Python considers an int
+    reject_bool = bool not in (types if isinstance(types, tuple) else (types,))
+
+    def check(conn):
+        value = conn
+        for key in keys:
+            if not isinstance(value, dict) or key not in value:
+                return path + ' missing' if required else None
+            value = value[key]
+        if not isinstance(value, types) or (reject_bool and isinstance(value, bool)):
+            return '{} must be {}'.format(path, type_names(types))
+        if isinstance(accepted, list):
+            if value not in accepted:
+                return '{} must be one of {}'.format(
+                    path, ', '.join(json.dumps(item) for item in accepted))
+        elif accepted and not accepted[0](value):
+            return '{} must be {}'.format(path, accepted[1])
+        return None
+
+    return check
+
+
+CONNECTION_CHECKS = [compile_check(*parameter) for parameter in CONNECTION_SCHEMA]
+PROPERTIES_CHECKS = [compile_check(*parameter) for parameter in PROPERTIES_SCHEMA]
+
+
+def expand_env(value, path=''):
+    """Replaces references to environment variables, e.g. "${AAVA_SECRET}", in
+    the string values with the values of the variables.
+
+    Raises:
+        PropertiesError: If a referred variable is not set
     """
-    Loads the properties from 'properties.json' to be used for connecting to
-    Aava API and to specify the modules that are used for retrieving the employee
-    and absence data from 
+    if isinstance(value, str):
+        def replace(match):
+            name = match.group(1)
+            if name not in os.environ:
+                raise PropertiesError(
+                    'environment variable {} used in {} is not set'.format(name, path))
+            return os.environ[name]
+        return ENV_REFERENCE.sub(replace, value)
+    if isinstance(value, dict):
+        return {key: expand_env(item, path + '.' + key if path else key)
+                for key, item in value.items()}
+    if isinstance(value, list):
+        return [expand_env(item, path) for item in value]
+    return value
+
+
+def read_properties(filename: str) -> dict:
+    """
+    Reads and parses a properties file. The result is cached, and the file is
+    parsed again only if it has been modified. The connections are neither
+    validated nor expanded here, see resolve_connection.
+
+    Args:
+        filename (str): Path to the properties file
 
+    Raises:
+        FileNotFoundError: If the file does not exist
+        PropertiesError: If the file is not valid
 
     Returns:
-        dict: A dictionary object with a number of connection parameter sets;
-            the parameter set for current connection is passed to import functions
+        dict: The properties, with the connections in list 'connections'
     """
+    stat = os.stat(filename)
+    cached = PROPERTIES.get(filename)
+    if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+        return cached[2]
+
+    try:
+        with open(filename) as json_file:
+            properties = json.load(json_file)
+    except ValueError as e:
+        raise PropertiesError('{} is not valid JSON: {}'.format(filename, e))
+    if not isinstance(properties, dict):
+        raise PropertiesError('{} must contain an object'.format(filename))
+
+    # The properties file should contain a list of connections. If only one set of connection
+    # parameters is provided, the list is created and this set included as the one and only
+    if "connections" not in properties:
+        properties = {'connections': [properties]}
+    if not isinstance(properties['connections'], list) or \
+            not all(isinstance(conn, dict) for conn in properties['connections']):
+        raise PropertiesError('connections must be a list of objects')
+
+    # The general settings are few, so they are expanded at once
+    properties = dict(expand_env({key: value for key, value in properties.items()
+                                  if key != 'connections'}),
+                      connections=properties['connections'])
+    for check in PROPERTIES_CHECKS:
+        problem = check(properties)
+        if problem:
+            raise PropertiesError(problem)
 
-    global PROPERTIES
+    PROPERTIES[filename] = (stat.st_mtime_ns, stat.st_size, properties)
+    return properties
 
-    if PROPERTIES:
-        return PROPERTIES
 
+def resolve_connection(conn: dict, conn_name: str) -> dict:
+    """
+    Validates the parameters of a connection and expands the references to
+    environment variables in them. This is done only for the connections that
+    are actually imported, so a large properties file is quick to start with.
+
+    Args:
+        conn (dict): The parameters of the connection as in the properties file
+        conn_name (str): Name of the connection used in the error messages
+
+    Raises:
+        PropertiesError: If the parameters are not complete or valid
+
+    Returns:
+        dict: The parameters of the connection to be used
+    """
+    in_conn = " in parameter set '{}'".format(conn_name)
     try:
-        with open('properties.json') as json_file:
-            PROPERTIES = json.load(json_file)
-
-            # The properties file should contain a list of connections. If only one set of connection
-            # parameters is provided, the list is created and this set included as the one and only
-            if "connections" not in PROPERTIES:
-                new_props = {'connections': [PROPERTIES]}
-                PROPERTIES = new_props
-
-            for conn in PROPERTIES['connections']:
-                conn_name = ''
-                if "connectionName" in conn:
-                    conn_name = " in parameter set '{}'".format(
-                        conn["connectionName"])
-                assert "aavaApiServer" in conn, "aavaApiServer missing" + conn_name
-                assert "clientId" in conn, "clientId missing" + conn_name
-                assert "clientSecret" in conn, "clientSecret missing" + conn_name
-                assert "organizationId" in conn, "organizationId missing" + conn_name
-                assert "hrMgmtSystem" in conn, "hrMgmtSystem missing" + conn_name
-                assert "moduleName" in conn["hrMgmtSystem"], "hrMgmtSystem.moduleName missing" + conn_name
-                assert "hourTrackingSystem" in conn, "hourTrackingSystem missing" + conn_name
-                assert "moduleName" in conn["hourTrackingSystem"], "hourTrackingSystem.moduleName missing" + conn_name
-
-            return PROPERTIES
+        conn = expand_env(conn)
+    except PropertiesError as e:
+        raise PropertiesError(str(e) + in_conn)
+
+    for check in CONNECTION_CHECKS:
+        problem = check(conn)
+        if problem:
+            raise PropertiesError(problem + in_conn)
+    return conn
+
+
+def load_properties(filename: str = None) -> dict:
+    """
+    Loads the properties from 'properties.json', or the given file, to be used for
+    connecting to Aava API and to specify the modules that are used for retrieving the
+    employee and absence data from. If the default file does not exist, it is created
+    from the template and the program exits.
+
+    Args:
+        filename (str, optional): Path to the properties file
 
+    Returns:
+        dict: A dictionary object with a number of connection parameter sets;
+            the parameter set for current connection is passed to import functions
+            after resolve_connection
+    """
+    try:
+        return read_properties(filename or DEFAULT_PROPERTIES_FILE)
     except FileNotFoundError:
-        shutil.copyfile('properties-template.json', 'properties.json')
+        if filename:
+            print("Properties file '{}' not found".format(filename))
+            exit(1)
+        shutil.copyfile(TEMPLATE_FILE, DEFAULT_PROPERTIES_FILE)
         print('''
         Empty properties file has been created as 'properties.json'
         Fill in the connection parameters and rerun the script
         ''')
         exit()
-    except AssertionError as e:
+    except PropertiesError as e:
         print("Properties file not complete:")
         print(repr(e))
         exit()
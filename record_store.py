@@ -0,0 +1,211 @@
+from array import array
+from datetime import date
+from functools import lru_cache
+from sys import intern
+
+from record_validator import FIELDS, KINDS
+
+# Dates are stored as ordinals of the proleptic Gregorian calendar, which
+# start from 1, so these can be used for the missing and null values
+MISSING_DATE = -1
+NULL_DATE = 0
+
+# Marks a missing field in the other columns, as None is a value of its own
+MISSING = object()
+
+# The fields of a department or supervisor period
+PERIOD_FIELDS = frozenset(['externalId', 'startDate', 'endDate'])
+
+
+@lru_cache(maxsize=65536)
+def parse_date(value):
+    """Returns the ordinal of a date in format YYYY-MM-DD, or None if the
+    value is not such a date."""
+    try:
+        parsed = date.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    # Newer Pythons accept other ISO formats too, which must be kept as they are
+    return parsed.toordinal() if parsed.isoformat() == value else None
+
+
+@lru_cache(maxsize=65536)
+def format_date(ordinal):
+    return date.fromordinal(ordinal).isoformat()
+
+
+def encode_date(value):
+    if value is MISSING:
+        return MISSING_DATE
+    if value is None:
+        return NULL_DATE
+    if type(value) is not str:
+        return None
+    return parse_date(value)
+
+
+def decode_date(ordinal, record, field):
+    if ordinal == NULL_DATE:
+        record[field] = None
+    elif ordinal != MISSING_DATE:
+        record[field] = format_date(ordinal)
+
+
+def compact(value):
+    return intern(value) if type(value) is str else value
+
+
+class Irregular(Exception):
+    """Raised when a record cannot be stored in the columns."""
+
+
+class PeriodColumn:
+    """The department or supervisor periods of the records, flattened into
+    columns of their own. For each record the number of its periods is kept,
+    or -1 for null and -2 for a missing field."""
+
+    def __init__(self):
+        self.counts = array('i')
+        self.ids = []
+        self.starts = array('i')
+        self.ends = array('i')
+
+    def encode(self, periods):
+        """Checks that the periods can be stored, returning them as tuples."""
+        if periods is MISSING or periods is None:
+            return periods
+        if type(periods) is not list:
+            raise Irregular()
+        encoded = []
+        for period in periods:
+            if type(period) is not dict or not period.keys() <= PERIOD_FIELDS:
+                raise Irregular()
+            start = encode_date(period.get('startDate', MISSING))
+            end = encode_date(period.get('endDate', MISSING))
+            if start is None or end is None:
+                raise Irregular()
+            encoded.append((compact(period.get('externalId', MISSING)), start, end))
+        return encoded
+
+    def append(self, encoded):
+        if encoded is MISSING:
+            self.counts.append(-2)
+        elif encoded is None:
+            self.counts.append(-1)
+        else:
+            self.counts.append(len(encoded))
+            for external_id, start, end in encoded:
+                self.ids.append(external_id)
+                self.starts.append(start)
+                self.ends.append(end)
+
+    def periods(self):
+        """Yields the periods of each record in turn, or MISSING."""
+        position = 0
+        for count in self.counts:
+            if count == -2:
+                yield MISSING
+                continue
+            if count == -1:
+                yield None
+                continue
+            periods = []
+            for index in range(position, position + count):
+                period = {}
+                if self.ids[index] is not MISSING:
+                    period['externalId'] = self.ids[index]
+                decode_date(self.starts[index], period, 'startDate')
+                decode_date(self.ends[index], period, 'endDate')
+                periods.append(period)
+            position += count
+            yield periods
+
+
+class RecordStore:
+    """A compact store for a large number of records of one import type,
+    e.g. the employees read from an HRM system that must be kept in memory.
+
+    Instead of a dict for each record, the values of each field are kept in a
+    column of their own: the dates as integers in arrays, the periods of the
+    employees in columns of their own and the strings interned, so that e.g.
+    the ID of a department is stored only once. Records with fields unknown to
+    the API, or with values that do not fit in the columns, such as invalid
+    dates, are kept as they are, so that they can still be reported.
+
+    Iterating over the store yields the records as dicts in the order they
+    were added, one at a time, so that they can be passed to the import
+    functions or returned by the source module functions like a list.
+
+    Args:
+        import_type (str): Type of the records (department, employee, ...)
+        records (iterable, optional): Records to be added at once
+    """
+
+    def __init__(self, import_type, records=()):
+        self.fields = list(FIELDS[import_type])
+        self.known = frozenset(self.fields)
+        self.kinds = [KINDS.get(field) for field in self.fields]
+        self.columns = []
+        for kind in self.kinds:
+            if kind == 'date':
+                self.columns.append(array('i'))
+            elif kind == 'periods':
+                self.columns.append(PeriodColumn())
+            else:
+                self.columns.append([])
+        # index of the record -> the record as it was added
+        self.irregular = {}
+        self.count = 0
+        self.extend(records)
+
+    def __len__(self):
+        return self.count
+
+    def append(self, record):
+        """Adds a record.
+
+        Args:
+            record (dict): The record as it would be passed to the import functions
+        """
+        try:
+            if type(record) is not dict or not record.keys() <= self.known:
+                raise Irregular()
+            values = []
+            for field, kind, column in zip(self.fields, self.kinds, self.columns):
+                value = record.get(field, MISSING)
+                if kind == 'date':
+                    value = encode_date(value)
+                    if value is None:
+                        raise Irregular()
+                elif kind == 'periods':
+                    value = column.encode(value)
+                else:
+                    value = compact(value)
+                values.append(value)
+        except Irregular:
+            self.irregular[self.count] = record
+            values = [MISSING_DATE if kind == 'date' else MISSING for kind in self.kinds]
+
+        for value, column in zip(values, self.columns):
+            column.append(value)
+        self.count += 1
+
+    def extend(self, records):
+        for record in records:
+            self.append(record)
+
+    def __iter__(self):
+        columns = [column.periods() if kind == 'periods' else iter(column)
+                   for kind, column in zip(self.kinds, self.columns)]
+        fields = list(zip(self.fields, self.kinds))
+        for index, values in enumerate(zip(*columns)):
+            if index in self.irregular:
+                yield self.irregular[index]
+                continue
+            record = {}
+            for (field, kind), value in zip(fields, values):
+                if kind == 'date':
+                    decode_date(value, record, field)
+                elif value is not MISSING:
+                    record[field] = value
+            yield record
@@ -0,0 +1,261 @@
+import re
+from datetime import date
+
+from aavahr_graphql import capfirst
+from log_handler import LOG_LEVEL, write_log
+
+# A date, optionally with a time, which the API accepts and ignores
+DATE_PATTERN = re.compile(r'\d{4}-\d{2}-\d{2}(?:[T ].*)?$')
+APPROVAL_TYPES = ['Supervisor', 'Doctor', 'Nurse']
+LANGUAGES = ['fi', 'sv', 'en']
+
+# The fields of each import type as in the input types of Aava-API, with
+# whether they are required. Fields not listed here are reported as unknown,
+# but they are not removed, as the API may have gained new fields.
+FIELDS = {
+    'department': {'externalId': True, 'names': False},
+    'costCenter': {'externalId': True, 'names': False},
+    'employee': {
+        'externalId': True, 'identifier': False, 'ssn': False, 'callName': True,
+        'lastName': True, 'emailAddress': False, 'privateEmailAddress': False,
+        'jobTitle': False, 'localPhoneNumber': False, 'phoneCountryCode': False,
+        'startDate': True, 'endDate': False, 'departments': False, 'supervisors': False,
+    },
+    'absence': {'externalId': True, 'startDate': True, 'endDate': False, 'approvalType': False},
+}
+REQUIRED = {import_type: [field for field, required in fields.items() if required]
+            for import_type, fields in FIELDS.items()}
+
+# How the value of each field is checked; the other fields are strings, or
+# numbers, which the API accepts as strings
+KINDS = {
+    'externalId': 'id', 'names': 'names', 'startDate': 'date', 'endDate': 'date',
+    'departments': 'periods', 'supervisors': 'periods', 'approvalType': 'approvalType',
+}
+
+# At most this many occurrences of each problem are logged one by one, the
+# rest are only counted in the summary of the import type
+MAX_REPORTED = 20
+
+# The same dates occur in many records, so the valid ones are remembered
+VALID_DATES = set()
+MAX_VALID_DATES = 100000
+
+
+def is_date(value):
+    if not isinstance(value, str):
+        return False
+    if value in VALID_DATES:
+        return True
+    if not DATE_PATTERN.match(value):
+        return False
+    try:
+        date.fromisoformat(value[:10])
+    except ValueError:
+        return False
+    if len(VALID_DATES) < MAX_VALID_DATES:
+        VALID_DATES.add(value)
+    return True
+
+
+def is_scalar(value):
+    return isinstance(value, (str, int, float)) and not isinstance(value, bool)
+
+
+def is_id(value):
+    return isinstance(value, (str, int)) and not isinstance(value, bool) and value != ''
+
+
+def check_period(record, errors, prefix=''):
+    """Checks the start and end dates of a record or of a period in it."""
+    start = record.get('startDate')
+    end = record.get('endDate')
+    if start is not None and not is_date(start):
+        errors.append('{}startDate is not a date in format YYYY-MM-DD'.format(prefix))
+    elif end is not None and not is_date(end):
+        errors.append('{}endDate is not a date in format YYYY-MM-DD'.format(prefix))
+    elif start is not None and end is not None and end[:10] < start[:10]:
+        errors.append('{}endDate is before startDate'.format(prefix))
+
+
+def check_fields(import_type, record, errors, unknown):
+    """Checks the shape of a record, appending the problems to 'errors' and
+    the names of the fields unknown to the API to 'unknown'."""
+    for field in REQUIRED[import_type]:
+        value = record.get(field)
+        if value is None or value == '':
+            errors.append('{} is missing'.format(field))
+
+    fields = FIELDS[import_type]
+    for field, value in record.items():
+        if field not in fields:
+            unknown.append(field)
+            continue
+        if value is None:
+            continue
+        kind = KINDS.get(field)
+        if kind is None:
+            if not is_scalar(value):
+                errors.append('{} is not a string or a number'.format(field))
+        elif kind == 'id':
+            if value != '' and not is_id(value):
+                errors.append('{} is not a string or an integer'.format(field))
+        elif kind == 'names':
+            if not isinstance(value, dict) or \
+                    not all(isinstance(name, str) for name in value.values()):
+                errors.append('names is not an object of strings')
+            elif any(language not in LANGUAGES for language in value):
+                errors.append('names has other languages than {}'.format(', '.join(LANGUAGES)))
+        elif kind == 'periods':
+            if not isinstance(value, list):
+                errors.append('{} is not an array'.format(field))
+                continue
+            for period in value:
+                if not isinstance(period, dict):
+                    errors.append('{} contains other than objects'.format(field))
+                    break
+                if not is_id(period.get('externalId')):
+                    errors.append('{} contains a period without externalId'.format(field))
+                if period.get('startDate') is None:
+                    errors.append('{} contains a period without startDate'.format(field))
+                check_period(period, errors, field + '.')
+        elif kind == 'approvalType':
+            if value not in APPROVAL_TYPES:
+                errors.append('approvalType is not one of {}'.format(', '.join(APPROVAL_TYPES)))
+    check_period(record, errors)
+
+
+def overlapping_periods(periods):
+    """Returns whether any of the periods (dicts with startDate and optional
+    endDate) overlap. Open-ended periods last until further notice."""
+    periods = sorted(periods, key=lambda period: period['startDate'])
+    for previous, period in zip(periods, periods[1:]):
+        end = previous.get('endDate')
+        if end is None or period['startDate'] <= end:
+            return True
+    return False
+
+
+class RecordValidator:
+    """Checks the records of a connection before they are sent, so that bad
+    data is reported at once instead of in the import warnings after the
+    whole import has been processed.
+
+    The shape of each record is checked against the input types of Aava-API.
+    Records with errors, such as a missing start date, are only reported, or
+    left out if 'mode' is "skip". In addition, references that cannot be
+    resolved are reported: departments and supervisors of employees, and
+    employees of absences, that are not among the records of this run. The
+    references to records of the same run are resolved from sets of external
+    IDs collected as the records pass, so each record is looked at only once.
+
+    Args:
+        mode (str): "skip" to leave out records with errors, "warn" to only
+            report them, or "off" to not validate the records at all
+    """
+
+    def __init__(self, mode='warn'):
+        if mode not in ['skip', 'warn', 'off']:
+            raise ValueError("Unknown validation mode '{}'".format(mode))
+        self.mode = mode
+        # import type -> external IDs of the records of this run
+        self.ids = {}
+        # (import type, problem) -> number of occurrences
+        self.problems = {}
+
+    def report(self, import_type, external_id, problem, detail=None):
+        key = (import_type, problem)
+        count = self.problems.get(key, 0) + 1
+        self.problems[key] = count
+        if count <= MAX_REPORTED:
+            message = "{} '{}': {}".format(capfirst(import_type), external_id, problem)
+            if detail is not None:
+                message += " '{}'".format(detail)
+            write_log(LOG_LEVEL.ERROR, message)
+
+    def summarize(self, import_type):
+        counts = ['{} x {}'.format(count, problem)
+                  for (problem_type, problem), count in self.problems.items()
+                  if problem_type == import_type]
+        if counts:
+            write_log(LOG_LEVEL.ERROR,
+                      "Problems found in {}s: {}".format(import_type, ', '.join(counts)))
+
+    def validate(self, import_type, records):
+        """Checks the records as they are iterated.
+
+        Args:
+            import_type (str): Type of the records (department, employee, ...)
+            records (iterable): The records read from the source
+
+        Yields:
+            dict: The records that can be sent
+        """
+        if self.mode == 'off':
+            yield from records
+            return
+
+        departments = self.ids.get('department')
+        employees = self.ids.get('employee')
+        ids = self.ids[import_type] = set()
+        # Supervisors may come after their subordinates, so the references
+        # are resolved after all the employees have been seen:
+        # supervisor ID -> ID of the first subordinate
+        supervisors = {}
+        seen = set()
+        skipped = 0
+        unknown_fields = set()
+
+        for record in records:
+            errors = []
+            unknown = []
+            if isinstance(record, dict):
+                check_fields(import_type, record, errors, unknown)
+            else:
+                record, errors = {}, ['record is not an object']
+
+            for field in unknown:
+                if field not in unknown_fields:
+                    unknown_fields.add(field)
+                    write_log(LOG_LEVEL.INFO,
+                              "Field '{}' of {}s is not known, sending it anyway".format(field, import_type))
+            for error in errors:
+                self.report(import_type, record.get('externalId'), error)
+            if errors and self.mode == 'skip':
+                skipped += 1
+                continue
+
+            external_id = record.get('externalId')
+            key = (external_id, record.get('startDate')) if import_type == 'absence' else external_id
+            if key in seen:
+                self.report(import_type, external_id, 'sent more than once')
+            seen.add(key)
+            ids.add(external_id)
+
+            if import_type == 'employee' and not errors:
+                self.check_employee(record, departments, supervisors)
+            elif import_type == 'absence' and employees is not None and external_id not in employees:
+                self.report(import_type, external_id, 'employee is not known')
+
+            yield record
+
+        for supervisor, subordinate in supervisors.items():
+            if supervisor not in ids:
+                self.report(import_type, subordinate, 'supervisor is not known', supervisor)
+        self.summarize(import_type)
+        if skipped:
+            write_log(LOG_LEVEL.ERROR,
+                      "{} {}s were left out because of errors".format(skipped, import_type))
+
+    def check_employee(self, record, departments, supervisors):
+        periods = record.get('departments') or []
+        if departments is not None:
+            for period in periods:
+                if period['externalId'] not in departments:
+                    self.report('employee', record['externalId'], 'department is not known',
+                                period['externalId'])
+        if len(periods) > 1 and overlapping_periods(periods):
+            self.report('employee', record['externalId'], 'department periods overlap')
+
+        for period in record.get('supervisors') or []:
+            supervisors.setdefault(period['externalId'], record['externalId'])
@@ -0,0 +1,96 @@
+import json
+import threading
+import uuid
+from datetime import datetime
+from time import perf_counter
+
+# Counters collected for each import type of a connection
+IMPORT_COUNTERS = ['fetchSeconds', 'serializeSeconds', 'submitSeconds', 'pollSeconds',
+                   'records', 'batches', 'requests', 'bytes', 'retries', 'statusPolls']
+
+
+def new_import_stats():
+    """Returns the counters of one import, filled in as the import proceeds."""
+    return {counter: 0 for counter in IMPORT_COUNTERS}
+
+
+def timed_records(records, stats):
+    """Passes the records through, adding the time spent reading them from the
+    source to 'fetchSeconds'. As the sources may be read lazily, this measures
+    the fetching separately from the serializing and sending that it interleaves
+    with.
+
+    Args:
+        records (iterable): The records read from the source
+        stats (dict): The counters of the import
+    """
+    records = iter(records)
+    while True:
+        started = perf_counter()
+        try:
+            record = next(records)
+        except StopIteration:
+            stats['fetchSeconds'] += perf_counter() - started
+            return
+        stats['fetchSeconds'] += perf_counter() - started
+        yield record
+
+
+class RunMetrics:
+    """Writes the timing and volume metrics of a run as JSON lines, one event
+    for each import type of each connection, one for each connection and a
+    summary at the end of the run.
+
+    Args:
+        filename (str): Path of the file the events are appended to; if None,
+            the metrics are not written anywhere
+    """
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.run_id = str(uuid.uuid4())
+        self.started = perf_counter()
+        self.lock = threading.Lock()
+        self.totals = {}
+        self.connections = 0
+        self.failed = []
+
+    def emit(self, event, **fields):
+        if not self.filename:
+            return
+        line = json.dumps(dict(
+            {'event': event, 'runId': self.run_id, 'time': datetime.now().isoformat()},
+            **fields))
+        with self.lock:
+            with open(self.filename, 'a') as metrics_file:
+                metrics_file.write(line + '\n')
+
+    def record_connection(self, conn_name, import_stats, poller, seconds, succeeded):
+        """Writes the events of a finished connection.
+
+        Args:
+            conn_name (str): Name of the connection
+            import_stats (dict): Counters of each import type of the connection
+            poller (StatusPoller): The status poller of the connection
+            seconds (float): Duration of the connection
+            succeeded (bool): Whether the import was run through
+        """
+        for import_type, stats in import_stats.items():
+            stats = dict(stats, **poller.type_stats.get(import_type, {}))
+            self.emit('import', connection=conn_name, importType=import_type, **stats)
+            with self.lock:
+                totals = self.totals.setdefault(import_type, new_import_stats())
+                for counter in IMPORT_COUNTERS:
+                    totals[counter] += stats[counter]
+
+        self.emit('connection', connection=conn_name, seconds=seconds, succeeded=succeeded,
+                  statusPolls=poller.stats['requests'], statusRetries=poller.stats['retries'])
+        with self.lock:
+            self.connections += 1
+            if not succeeded:
+                self.failed.append(conn_name)
+
+    def summary(self):
+        """Writes the summary of the whole run."""
+        self.emit('summary', seconds=perf_counter() - self.started,
+                  connections=self.connections, failed=self.failed, imports=self.totals)
@@ -0,0 +1,145 @@
+import json
+import re
+import sqlite3
+from hashlib import sha1
+
+from log_handler import LOG_LEVEL, write_log
+
+
+def record_key(import_type, record):
+    """Returns the key identifying the record between runs. Absences share the
+    external ID of the employee, so their start date is included in the key.
+    """
+    if import_type == 'absence':
+        return '{}/{}'.format(record['externalId'], record['startDate'])
+    return str(record['externalId'])
+
+
+def record_hash(record):
+    return sha1(json.dumps(record, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def default_snapshot_file(conn_name):
+    return 'snapshot-{}.sqlite'.format(re.sub(r'[^\w.-]', '_', conn_name))
+
+
+class SnapshotStore:
+    """Keeps the content hashes of the records sent through one connection in
+    an SQLite file, so that only new and changed records need to be sent.
+
+    The hashes are saved only after the import has been processed successfully,
+    and records that received warnings are left out, so that they will be
+    sent again on the next run.
+
+    Args:
+        filename (str): Path to the SQLite file
+        reconcile (bool): Whether records no longer available in the source are
+            reported and removed from the snapshot
+        read_only (bool): Whether the snapshot is only compared to; with
+            reconcile, the missing records are reported but not removed
+    """
+
+    def __init__(self, filename, reconcile=False, read_only=False):
+        self.reconcile = reconcile
+        self.read_only = read_only
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS snapshot (
+                import_type TEXT NOT NULL,
+                record_key TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                PRIMARY KEY (import_type, record_key)
+            )
+        """)
+        self.db.commit()
+
+        # import type -> {record key: hash} of the changed records not yet saved
+        self.changed = {}
+        # import type -> message IDs of the imports containing the changes
+        self.awaiting = {}
+        # message ID -> status of the finished imports
+        self.statuses = {}
+
+    def changes(self, import_type, records):
+        """Filters out the records that are identical to the ones sent earlier.
+        The records are filtered as they are iterated, so the source is not
+        read into memory. Only the hashes are kept until the import is done.
+
+        Args:
+            import_type (str): Type of the records (department, employee, ...)
+            records (iterable): All the records read from the source
+
+        Yields:
+            dict: The new and changed records
+        """
+        stored = dict(self.db.execute(
+            "SELECT record_key, hash FROM snapshot WHERE import_type = ?",
+            (import_type,)))
+
+        changed = {}
+        self.changed[import_type] = changed
+        for record in records:
+            key = record_key(import_type, record)
+            digest = record_hash(record)
+            if stored.pop(key, None) != digest:
+                changed[key] = digest
+                yield record
+
+        # Whatever is left in the stored hashes was not found in the source anymore
+        if self.reconcile and stored:
+            write_log(LOG_LEVEL.NOTICE,
+                      "{} {}s no longer found in source: {}".format(
+                          len(stored), import_type, ', '.join(sorted(stored))))
+            if self.read_only:
+                return
+            self.db.executemany(
+                "DELETE FROM snapshot WHERE import_type = ? AND record_key = ?",
+                [(import_type, key) for key in stored])
+            self.db.commit()
+
+    def submitted(self, import_type, msg_ids):
+        """Binds the pending changes of the import type to the imports that sent them.
+
+        Args:
+            import_type (str): Type of the records (department, employee, ...)
+            msg_ids (list): Message IDs of the imports
+        """
+        self.awaiting[import_type] = list(msg_ids)
+
+    def confirm(self, statuses):
+        """Saves the hashes of the changes once all the imports sending them
+        have been finished successfully. If any of them failed, the changes are
+        discarded and sent again on the next run.
+
+        Args:
+            statuses (list): Status objects of finished imports
+        """
+        for status in statuses:
+            self.statuses[status['messageId']] = status
+
+        for import_type, msg_ids in list(self.awaiting.items()):
+            if not all(msg_id in self.statuses for msg_id in msg_ids):
+                continue
+            del self.awaiting[import_type]
+            changed = self.changed.pop(import_type, {})
+            statuses = [self.statuses.pop(msg_id) for msg_id in msg_ids]
+            if any(status['importStatus'] != 'DONE' for status in statuses):
+                continue
+
+            warned = set()
+            for status in statuses:
+                for warning in status['warnings'] or []:
+                    warned.add(str(warning['externalId']))
+
+            rows = []
+            for key, digest in changed.items():
+                external_id = key.rsplit('/', 1)[0] if import_type == 'absence' else key
+                if external_id not in warned:
+                    rows.append((import_type, key, digest))
+            self.db.executemany(
+                "INSERT OR REPLACE INTO snapshot (import_type, record_key, hash) VALUES (?, ?, ?)",
+                rows)
+            self.db.commit()
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,135 @@
+import threading
+from queue import Queue, Full
+
+# Records are passed from the fetching threads in chunks of this many, and
+# at most this many chunks of each import type are read ahead by default
+CHUNK_SIZE = 500
+DEFAULT_BUFFER = 20
+
+# Marks the end of the records of an import type
+DONE = object()
+# Marks an import type whose source function returned None
+UNCHANGED = object()
+
+
+def iter_records(records, function_name):
+    """Accepts the records returned by a source module function. The function
+    may return a list, a generator or any other iterable of records, or None
+    if the source has not changed and there is nothing to import.
+
+    Args:
+        records (iterable): The value returned by the function
+        function_name (str): Name of the function, used in the error message
+
+    Raises:
+        TypeError: If the returned value is not iterable
+
+    Returns:
+        iterator: An iterator over the records, or None if None was returned
+    """
+    if records is None:
+        return None
+    try:
+        return iter(records)
+    except TypeError:
+        raise TypeError("{} must return a list or an iterable of records, not {}".format(
+            function_name, type(records).__name__))
+
+
+class SourcePrefetcher:
+    """Reads the source systems of a connection in background threads, so
+    that e.g. the absences are being fetched while the employees are being
+    processed by the API, instead of only after that.
+
+    Each source system is read by its own thread, calling the functions of
+    its module in the same order as they would be called otherwise, as some
+    modules rely on it. The records are passed to the importing thread
+    through a bounded queue for each import type, so that at most 'buffer'
+    chunks of records are read ahead.
+
+    Args:
+        buffer (int): Number of chunks of records read ahead of the import
+    """
+
+    def __init__(self, buffer=DEFAULT_BUFFER):
+        self.buffer = buffer
+        self.queues = {}
+        self.cancelled = threading.Event()
+
+    def start(self, sources):
+        """Starts reading the sources.
+
+        Args:
+            sources (list): For each thread, a list of (import type, function,
+                properties) tuples of the functions to be called in order
+        """
+        for functions in sources:
+            if not functions:
+                continue
+            for import_type, _, _ in functions:
+                self.queues[import_type] = Queue(self.buffer)
+            threading.Thread(target=self.run, args=(functions,),
+                             name='prefetch-' + functions[0][0], daemon=True).start()
+
+    def cancel(self):
+        """Stops the threads once they try to pass on more records."""
+        self.cancelled.set()
+
+    def put(self, queue, item):
+        while not self.cancelled.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def run(self, functions):
+        for import_type, function, props in functions:
+            queue = self.queues[import_type]
+            try:
+                records = iter_records(function(props), function.__name__)
+                if records is None:
+                    if not self.put(queue, UNCHANGED):
+                        return
+                    continue
+                chunk = []
+                for record in records:
+                    chunk.append(record)
+                    if len(chunk) >= CHUNK_SIZE:
+                        if not self.put(queue, chunk):
+                            return
+                        chunk = []
+                if not self.put(queue, chunk) or not self.put(queue, DONE):
+                    return
+            except BaseException as e:
+                # Also SystemExit, as source modules call exit() on errors;
+                # it is raised again in the importing thread
+                if not self.put(queue, e):
+                    return
+
+    def records(self, import_type):
+        """Returns the records of an import type as they are read. Blocks
+        until the source function of the import type has returned.
+
+        Args:
+            import_type (str): Type of the records (department, employee, ...)
+
+        Returns:
+            iterator: An iterator over the records, or None if the source
+                function returned None
+        """
+        queue = self.queues[import_type]
+        item = queue.get()
+        if item is UNCHANGED:
+            return None
+        return self.iterate(queue, item)
+
+    def iterate(self, queue, item):
+        while True:
+            if item is DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield from item
+            item = queue.get()
@@ -0,0 +1,302 @@
+import random
+import threading
+import weakref
+from collections import deque
+from statistics import median
+from time import monotonic, sleep
+
+import aavahr_graphql as api
+from log_handler import LOG_LEVEL, write_log
+
+# Statuses meaning that the import has not been finished yet
+UNFINISHED_STATUSES = ['UNKNOWN', 'IN_PROGRESS']
+
+# How long the recent imports of each type have taken, in seconds. These are
+# shared by all the connections of the run, so that e.g. the employee import of
+# the second connection can be expected to take about as long as the first one.
+IMPORT_DURATIONS = {}
+DURATIONS_LOCK = threading.Lock()
+DURATION_HISTORY = 5
+
+
+def record_duration(import_type, duration):
+    with DURATIONS_LOCK:
+        history = IMPORT_DURATIONS.setdefault(
+            import_type, deque(maxlen=DURATION_HISTORY))
+        history.append(duration)
+
+
+def expected_duration(import_type):
+    """Returns the median duration of the recent imports of the given type,
+    or None if no such import has been finished during this run.
+    """
+    with DURATIONS_LOCK:
+        history = IMPORT_DURATIONS.get(import_type)
+        if not history:
+            return None
+        return median(history)
+
+
+class StatusGroup:
+    """The imports in flight of all the connections that use the same Aava API
+    server, organization and client. Their statuses are queried together, so
+    that the number of status requests does not grow with the number of
+    connections run in parallel.
+
+    The pollers of the group poll on their own schedule as before, but a poll
+    covers the imports of all of them, and a poller that wakes up after
+    another one has polled on its behalf uses that result instead of sending
+    a request of its own.
+    """
+
+    def __init__(self):
+        # All the state of the pollers of the group is guarded by this
+        self.condition = threading.Condition(threading.RLock())
+        self.pollers = weakref.WeakSet()
+        # When the latest poll was started, and whether it is still running
+        self.started = None
+        self.polling = False
+
+    def poll(self, poller, since):
+        """Makes sure the statuses of the imports of the poller have been
+        queried after 'since', by polling or by waiting for a poll started
+        by another poller of the group.
+
+        Args:
+            poller (StatusPoller): The poller needing the statuses
+            since (float): Monotonic time after which the poll must have started
+        """
+        with self.condition:
+            while self.polling:
+                self.condition.wait()
+            if self.started is not None and self.started >= since:
+                return
+            owners = {msg_id: member for member in self.pollers
+                      for msg_id in member.in_flight}
+            if not owners:
+                return
+            self.polling = True
+            self.started = monotonic()
+
+        res = None
+        try:
+            res = api.get_statuses(poller.conn, list(owners), poller.stats)
+        finally:
+            with self.condition:
+                if res is not None:
+                    now = monotonic()
+                    for member in set(owners.values()):
+                        member.count_poll()
+                    for status in res['processingStatusWithVerify']:
+                        owner = owners.get(status['messageId'])
+                        if owner:
+                            owner.receive(status, now)
+                    # Also the imports missing from the response time out
+                    for member in set(owners.values()):
+                        member.expire(now)
+                self.polling = False
+                self.condition.notify_all()
+
+        remaining = sum(len(member.in_flight) for member in set(owners.values()))
+        if remaining:
+            write_log(LOG_LEVEL.DEBUG, "{} imports still processing...".format(remaining))
+
+
+# The status groups by Aava API server, organization and client ID
+STATUS_GROUPS = {}
+GROUPS_LOCK = threading.Lock()
+
+
+def status_group(conn):
+    key = (conn['aavaApiServer'], str(conn['organizationId']), str(conn['clientId']))
+    with GROUPS_LOCK:
+        if key not in STATUS_GROUPS:
+            STATUS_GROUPS[key] = StatusGroup()
+        return STATUS_GROUPS[key]
+
+
+class StatusPoller:
+    """Polls the statuses of the imports sent through one connection.
+
+    Instead of polling at a fixed interval, the interval starts short and grows
+    exponentially (with jitter) while the imports are being processed. If
+    imports of the same type have been finished earlier, the first poll is
+    postponed until the import can be expected to be nearly done. The imports
+    of connections sharing the server, organization and client are polled
+    together, see StatusGroup.
+
+    Following optional connection parameters are used:
+        pollInterval (float): The initial interval in seconds, default 0.5
+        pollMaxInterval (float): The maximum interval in seconds, default 30
+        pollTimeout (float): How long a single import is waited for in seconds,
+            default 3600
+        maxInFlight (int): Maximum number of imports being processed at once,
+            default unlimited
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.interval = conn.get('pollInterval', 0.5)
+        self.max_interval = conn.get('pollMaxInterval', 30)
+        self.timeout = conn.get('pollTimeout', 3600)
+        self.max_in_flight = conn.get('maxInFlight')
+
+        # message ID -> (import type, time of submission)
+        self.in_flight = {}
+        # message ID -> final status object
+        self.finished = {}
+        # message ID -> function called with the final status, see track
+        self.listeners = {}
+
+        # Counters of the status requests, and of the polling of each import type
+        self.stats = {'requests': 0, 'bytes': 0, 'submitSeconds': 0, 'retries': 0}
+        self.type_stats = {}
+
+        self.group = status_group(conn)
+        self.lock = self.group.condition
+        with self.lock:
+            self.group.pollers.add(self)
+
+    def track(self, msg_id, import_type, listener=None):
+        """Starts tracking an import that has just been sent.
+
+        Args:
+            msg_id (str): Message ID returned by the import
+            import_type (str): Type of the import (department, employee, ...)
+            listener (function, optional): Called with the final status object
+                and the monotonic times of the submission and of the poll that
+                found the import finished
+        """
+        with self.lock:
+            self.in_flight[msg_id] = (import_type, monotonic())
+            if listener:
+                self.listeners[msg_id] = listener
+
+    def resume(self, msg_id, import_type, status=None):
+        """Takes over an import sent by an interrupted run.
+
+        Args:
+            msg_id (str): Message ID of the import
+            import_type (str): Type of the import (department, employee, ...)
+            status (dict, optional): The final status of the import, if it was
+                already known; otherwise the status is polled
+        """
+        if status:
+            with self.lock:
+                self.finished[msg_id] = status
+        else:
+            self.track(msg_id, import_type)
+
+    def wait_for_slot(self):
+        """Blocks until there are fewer imports in flight than allowed by
+        'maxInFlight', so that another one can be sent.
+        """
+        if not self.max_in_flight:
+            return
+        self.poll_until(lambda: len(self.in_flight) < self.max_in_flight)
+
+    def wait(self, msg_ids):
+        """Blocks until all the given imports have been finished or timed out.
+
+        Args:
+            msg_ids (list): Message IDs of the imports
+
+        Returns:
+            list: The final status objects of the imports, in the given order
+        """
+        with self.lock:
+            for msg_id in msg_ids:
+                if msg_id not in self.in_flight and msg_id not in self.finished:
+                    self.track(msg_id, None)
+
+        self.poll_until(lambda: all(m in self.finished for m in msg_ids))
+        with self.lock:
+            return [self.finished.pop(msg_id) for msg_id in msg_ids]
+
+    def poll_until(self, condition):
+        attempt = 0
+        while True:
+            with self.lock:
+                if condition():
+                    return
+                delay = self.next_delay(attempt)
+            since = monotonic()
+            sleep(delay)
+            self.group.poll(self, since)
+            attempt += 1
+
+    def next_delay(self, attempt):
+        now = monotonic()
+        delay = min(self.max_interval, self.interval * 2 ** attempt)
+        delay = delay / 2 + random.uniform(0, delay / 2)
+
+        # Do not poll before any of the imports can be expected to be ready
+        earliest = None
+        for import_type, submitted in self.in_flight.values():
+            expected = expected_duration(import_type)
+            ready = submitted + expected * 0.9 if expected else now
+            if earliest is None or ready < earliest:
+                earliest = ready
+        if earliest is not None and earliest - now > delay:
+            delay = min(self.max_interval, earliest - now)
+
+        return delay
+
+    def poll(self):
+        """Queries the statuses of all the imports in flight in the status
+        group of the connection with one request."""
+        self.group.poll(self, monotonic())
+
+    def count_poll(self):
+        """Counts a poll covering the imports of this poller."""
+        for import_type in set(import_type for import_type, _ in self.in_flight.values()):
+            type_stats = self.type_stats.setdefault(
+                import_type, {'statusPolls': 0, 'pollSeconds': 0})
+            type_stats['statusPolls'] += 1
+
+    def receive(self, status, now):
+        """Handles the status of an import of this poller received by a poll.
+
+        Args:
+            status (dict): The status object
+            now (float): Monotonic time of the poll
+        """
+        msg_id = status['messageId']
+        if msg_id not in self.in_flight:
+            return
+        import_type, submitted = self.in_flight[msg_id]
+        if status['importStatus'] not in UNFINISHED_STATUSES:
+            if import_type:
+                record_duration(import_type, now - submitted)
+        elif now - submitted > self.timeout:
+            status = dict(status, importStatus='TIMEOUT',
+                          error="No result in {} seconds".format(self.timeout))
+        else:
+            return
+        self.finish(msg_id, status, now)
+
+    def expire(self, now):
+        """Marks the imports of this poller that have been waited for longer
+        than 'pollTimeout' as timed out, whether their status was received or
+        not, so that an import the server does not report is not waited for
+        forever.
+
+        Args:
+            now (float): Monotonic time of the poll
+        """
+        for msg_id, (import_type, submitted) in list(self.in_flight.items()):
+            if now - submitted > self.timeout:
+                self.finish(msg_id, {
+                    'messageId': msg_id, 'importType': import_type, 'timestamp': None,
+                    'importStatus': 'TIMEOUT', 'warnings': [],
+                    'error': "No result in {} seconds".format(self.timeout)}, now)
+
+    def finish(self, msg_id, status, now):
+        import_type, submitted = self.in_flight.pop(msg_id)
+        self.finished[msg_id] = status
+        listener = self.listeners.pop(msg_id, None)
+        if listener:
+            listener(status, submitted, now)
+        if import_type in self.type_stats:
+            type_stats = self.type_stats[import_type]
+            type_stats['pollSeconds'] = max(type_stats['pollSeconds'], now - submitted)
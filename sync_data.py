@@ -1,17 +1,69 @@
 import json
 import importlib
 from os import write
-from time import sleep
-from sys import argv
+from sys import argv, modules
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from time import perf_counter
 
 # All the API calls are wrapped in functions
 import aavahr_graphql as api
 
 # Properties are read using a specific mnodule
-from prop_handler import load_properties
+from prop_handler import PropertiesError, load_properties, resolve_connection
 
 # There is also a module for handling writing to logs
-from log_handler import LOG_LEVEL, write_log, set_log_file, set_log_level
+from log_handler import LOG_LEVEL, write_log, set_log_file, set_log_level, set_log_prefix, \
+    set_console_level, flush_logs
+
+# Statuses of the imports are polled with adaptive intervals
+from status_poller import StatusPoller
+
+# In delta mode, hashes of the records sent earlier are kept in a snapshot store
+from snapshot_store import SnapshotStore, default_snapshot_file
+
+# Records are checked before they are sent
+from record_validator import RecordValidator
+
+# Overlapping and contiguous periods can be merged before sending
+from period_merger import merge_absences, merge_employee_periods
+
+# The batches sent are recorded, so that an interrupted run can be resumed
+from checkpoint_journal import CheckpointJournal, DEFAULT_CHECKPOINT_FILE
+
+# The source systems are read in background threads while importing
+from source_prefetch import SourcePrefetcher, DEFAULT_BUFFER, iter_records
+
+# Warnings of the imports are summarized in the log and written to a report
+from warning_report import ConnectionWarnings, WarningReport, DEFAULT_EXAMPLES
+
+# Batch sizes can be tuned by the observed processing times and kept for the next run
+from batch_sizer import BatchSizeStore, DEFAULT_BATCH_SIZE_FILE
+
+# Where the time of the run is spent can be followed with metrics
+from run_metrics import RunMetrics, new_import_stats, timed_records
+
+
+# The sections of the source systems in the connection parameters
+SOURCE_SYSTEMS = ['hrMgmtSystem', 'hourTrackingSystem']
+
+# For each import type, in the order of importing: the source system, the
+# source module function, the name used in the log and the function merging
+# the periods of the records with 'mergePeriods'
+IMPORT_TYPES = {
+    'department': ('hrMgmtSystem', 'get_departments', 'departments', None),
+    'costCenter': ('hrMgmtSystem', 'get_cost_centers', 'cost centers', None),
+    'employee': ('hrMgmtSystem', 'get_personnel', 'employees', merge_employee_periods),
+    'absence': ('hourTrackingSystem', 'get_absences', 'absences', merge_absences),
+}
+
+# The command line argument enabling the import of each type
+IMPORT_ARGUMENTS = {
+    'department': 'import_departments',
+    'costCenter': 'import_cost_centers',
+    'employee': 'import_employees',
+    'absence': 'import_absences',
+}
 
 
 def get_command_line_arguments():
@@ -21,7 +73,13 @@ def get_command_line_arguments():
         'import_employees': True,
         'import_absences': True,
         'import_only_organization': None,
-        'read_only': False
+        'read_only': False,
+        'pipelined': False,
+        'delta': False,
+        'reconcile': False,
+        'resume': False,
+        'parallel': 1,
+        'config': None
     }
 
     # Check the command line parameters to see, what is required of this run
@@ -36,6 +94,12 @@ def get_command_line_arguments():
         '-sa': 'Short for --suppress_absences',
         '--import_org': 'Only import named organization',
         '--read_only': 'Only read the information and show output on screen, do not call API',
+        '--pipelined': 'Submit independent imports at once and poll their statuses together',
+        '--delta': 'Only send records that have changed since the last run',
+        '--reconcile': 'With --delta, report records that are no longer found in the source',
+        '--parallel': 'Run the given number of connections at the same time',
+        '--resume': 'Continue an interrupted run, without sending again what was already sent',
+        '--config': 'Read the properties from the given file instead of properties.json',
         '--help': 'Show this help',
     }
 
@@ -46,6 +110,8 @@ and sends it to Aava-API.
 How to use:
 python sync_data.py [--help] [--suppress_deps] [--suppress_employees]
     [--suppress_absences] [--import_org "<org name>"] [--read_only]
+    [--pipelined] [--delta [--reconcile]] [--parallel N] [--resume]
+    [--config <properties file>]
 
 Options:''')
         for k_arg in acceptable_args.keys():
@@ -74,6 +140,24 @@ Options:''')
         if a == '--read_only':
             arguments['read_only'] = True
 
+        if a == '--pipelined':
+            arguments['pipelined'] = True
+
+        if a == '--delta':
+            arguments['delta'] = True
+
+        if a == '--reconcile':
+            arguments['reconcile'] = True
+
+        if a == '--resume':
+            arguments['resume'] = True
+
+        if a == '--parallel':
+            arguments['parallel'] = int(cli_args.pop(0))
+
+        if a == '--config':
+            arguments['config'] = cli_args.pop(0)
+
         if a == '--import_org':
             org = cli_args.pop(0)
             arguments['import_only_organization'] = org
@@ -81,63 +165,448 @@ Options:''')
     return arguments
 
 
-def process_results(conn, msg_id):
-    while True:
-        # Keep reading status until it is ready
-        res = api.get_statuses(conn, [msg_id])
-        status = res['processingStatusWithVerify']
-        if status[0]['importStatus'] not in ['UNKNOWN', 'IN_PROGRESS']:
-            break
-        print('processing...')
-        sleep(1)
-
-    write_log(LOG_LEVEL.NOTICE,
-              "For " + str(status[0]['importType']) +
-              " at " + str(status[0]['timestamp']))
-    write_log(LOG_LEVEL.NOTICE,
-              "Message ID: " + status[0]['messageId'])
-    write_log(LOG_LEVEL.NOTICE,
-              "Status    : " + status[0]['importStatus'])
-    if status[0]['importStatus'] == 'FAILURE':
+def fetch_records(function, props, stats, prefetcher=None, import_type=None):
+    """Calls a source module function and times reading the records from it.
+    If the source is being read by a prefetcher, the records are taken from
+    it instead, and only the time spent waiting for them is counted.
+
+    Args:
+        function (function): The source module function, e.g. get_personnel
+        props (dict): The properties section of the source system
+        stats (dict): Counters of the import, 'fetchSeconds' is increased
+        prefetcher (SourcePrefetcher, optional): Prefetcher of the connection
+        import_type (str, optional): Type of the records in the prefetcher
+
+    Returns:
+        iterator: An iterator over the records, or None if the source has not
+            changed and there is nothing to import
+    """
+    started = perf_counter()
+    if prefetcher:
+        records = prefetcher.records(import_type)
+    else:
+        records = iter_records(function(props), function.__name__)
+    stats['fetchSeconds'] += perf_counter() - started
+    if records is None:
+        return None
+    return timed_records(records, stats)
+
+
+def peek_records(records):
+    """Checks whether there are any records without losing the first one.
+
+    Args:
+        records (iterable): The records
+
+    Returns:
+        iterator: An iterator over all the records, or None if there are none
+    """
+    records = iter(records)
+    try:
+        first = next(records)
+    except StopIteration:
+        return None
+    return chain([first], records)
+
+
+def print_records(records):
+    """Prints the records on screen as a JSON array. The records are printed
+    one at a time, so that they need not be all in memory at once.
+
+    Args:
+        records (iterable): The records read from a source system
+    """
+    first = True
+    for record in records:
+        lines = json.dumps(record, indent=4, sort_keys=True).split('\n')
+        print(('[' if first else ',') + '\n    ' + '\n    '.join(lines), end='')
+        first = False
+    print('[]' if first else '\n]')
+
+
+def process_results(poller, msg_ids, warnings=None):
+    """Waits until all the given imports have been processed and writes their
+    results in the log.
+
+    Args:
+        poller (StatusPoller): The poller of the connection the imports were sent with
+        msg_ids (list): Message IDs of the imports, e.g. one for each batch
+        warnings (ConnectionWarnings, optional): Handler of the warnings of the connection
+
+    Returns:
+        list: The status objects of the imports
+    """
+    statuses = poller.wait(msg_ids)
+    if warnings is None:
+        warnings = ConnectionWarnings(None)
+
+    for status in statuses:
+        write_log(LOG_LEVEL.NOTICE,
+                  "For " + str(status['importType']) +
+                  " at " + str(status['timestamp']))
+        write_log(LOG_LEVEL.NOTICE,
+                  "Message ID: " + status['messageId'])
+        write_log(LOG_LEVEL.NOTICE,
+                  "Status    : " + status['importStatus'])
+        if status['importStatus'] in ['FAILURE', 'TIMEOUT']:
+            write_log(LOG_LEVEL.CRITICAL,
+                      "Error     : " + status['error'])
+        warnings.process(status)
+
+    return statuses
+
+
+def flush_pending(poller, pending, snapshots=None, journal=None, warnings=None):
+    """Waits for the pending imports to be processed and empties the list.
+
+    Args:
+        poller (StatusPoller): The poller of the connection the imports were sent with
+        pending (list): Message IDs of the imports not yet waited for
+        snapshots (SnapshotStore, optional): Snapshot store to confirm the results to
+        journal (ConnectionJournal, optional): Checkpoint journal to record the results in
+        warnings (ConnectionWarnings, optional): Handler of the warnings of the connection
+
+    Returns:
+        list: The status objects of the imports
+    """
+    if not pending:
+        return []
+    statuses = process_results(poller, pending, warnings)
+    if snapshots:
+        snapshots.confirm(statuses)
+    if journal:
+        journal.finished(statuses)
+    pending.clear()
+    return statuses
+
+
+def set_connection_logging(conn, props):
+    """Sets the log file and level of the current thread for the connection.
+    If there are connection specific log settings, they are used instead of
+    the general ones.
+
+    Args:
+        conn (dict): Parameters of the connection
+        props (dict): All the properties
+    """
+    if "logFile" in conn:
+        set_log_file(conn["logFile"])
+    elif "logFile" in props:
+        set_log_file(props["logFile"])
+    else:
+        set_log_file(None)
+
+    if "logLevel" in conn:
+        set_log_level(LOG_LEVEL(conn["logLevel"]))
+    elif "logLevel" in props:
+        set_log_level(LOG_LEVEL(props["logLevel"]))
+    else:
+        set_log_level(None)
+
+    if "consoleLogLevel" in conn:
+        set_console_level(LOG_LEVEL(conn["consoleLogLevel"]))
+    elif "consoleLogLevel" in props:
+        set_console_level(LOG_LEVEL(props["consoleLogLevel"]))
+    else:
+        set_console_level(None)
+
+
+def run_connection(conn, conn_name, props, args, metrics, journal=None, report=None,
+                   batch_sizes=None):
+    """Reads the data from the source systems of one connection and imports
+    it to Aava-API.
+
+    Args:
+        conn (dict): Parameters of the connection
+        conn_name (str): Name of the connection used in logs
+        props (dict): All the properties
+        args (dict): Command line arguments
+        metrics (RunMetrics): Metrics of the run
+        journal (CheckpointJournal, optional): Checkpoint journal of the run
+        report (WarningReport, optional): Warning report of the run
+        batch_sizes (BatchSizeStore, optional): Batch sizes learned by the runs
+    """
+    set_connection_logging(conn, props)
+
+    poller = StatusPoller(conn)
+    prefetcher = None
+    if conn.get('prefetch', True):
+        prefetcher = SourcePrefetcher(conn.get('prefetchBuffer', DEFAULT_BUFFER))
+    import_stats = {}
+    started = perf_counter()
+    succeeded = False
+    try:
+        import_connection(conn, conn_name, args, poller, import_stats,
+                          journal.connection(conn_name) if journal else None, prefetcher,
+                          report, batch_sizes)
+        succeeded = True
+    finally:
+        if prefetcher:
+            prefetcher.cancel()
+        if batch_sizes:
+            batch_sizes.save()
+        release_sources(conn)
+        metrics.record_connection(conn_name, import_stats, poller,
+                                  perf_counter() - started, succeeded)
+        # The log of the connection is complete in the file once it is done
+        flush_logs()
+
+
+def release_sources(conn):
+    """Lets the source modules of a connection free the data they have cached
+    for it, by calling their optional function release(props).
+
+    Args:
+        conn (dict): Parameters of the connection
+    """
+    for system in SOURCE_SYSTEMS:
+        module = modules.get(conn[system]["moduleName"])
+        if module and hasattr(module, "release"):
+            module.release(conn[system])
+
+
+class ConnectionImport:
+    """Imports the records of each type of one connection in turn, keeping
+    track of the imports that have been sent but not yet waited for. In
+    pipelined mode the imports that do not depend on each other are sent at
+    once and their statuses polled together.
+
+    Args:
+        conn (dict): Parameters of the connection
+        args (dict): Command line arguments
+        poller (StatusPoller): Status poller of the connection
+        import_stats (dict): Counters of each import type are collected here
+        sources (dict): The source modules by the source system sections
+        journal (ConnectionJournal, optional): Checkpoint journal of the connection
+        prefetcher (SourcePrefetcher, optional): Prefetcher reading the sources
+        snapshots (SnapshotStore, optional): Snapshot store in delta mode
+        warnings (ConnectionWarnings, optional): Handler of the warnings
+        sizers (dict, optional): Batch sizers of the import types
+    """
+
+    def __init__(self, conn, args, poller, import_stats, sources, journal=None,
+                 prefetcher=None, snapshots=None, warnings=None, sizers=None):
+        self.conn = conn
+        self.args = args
+        self.poller = poller
+        self.import_stats = import_stats
+        self.sources = sources
+        self.journal = journal
+        self.prefetcher = prefetcher
+        self.snapshots = snapshots
+        self.warnings = warnings or ConnectionWarnings(None)
+        self.sizers = sizers or {}
+        # The records are validated before they are compared to the snapshot,
+        # so that the references can be checked against all the source records
+        self.validator = RecordValidator(conn.get('validation', 'warn'))
+        # Message IDs of the imports that have been sent but not yet waited for
+        self.pending = []
+        # Message IDs of each import type not yet known to be finished, and
+        # the final statuses of the imports
+        self.awaiting = {}
+        self.results = {}
+
+    def run_import(self, import_type):
+        """Reads the records of one type from the source system, checks them
+        and sends them to Aava-API, or prints them in read only mode.
+
+        Args:
+            import_type (str): Type of the import (department, employee, ...)
+        """
+        system, function, name, merge = IMPORT_TYPES[import_type]
+        stats = self.import_stats[import_type] = new_import_stats()
+        records = fetch_records(getattr(self.sources[system], function), self.conn[system],
+                                stats, self.prefetcher, import_type)
+        # None from the source means that it has not changed, so there is
+        # nothing to send, compare with the snapshot or check
+        if records is not None:
+            if merge and self.conn.get('mergePeriods'):
+                records = merge(records)
+            records = self.validator.validate(import_type, records)
+            if self.snapshots:
+                records = peek_records(self.snapshots.changes(import_type, records))
+
+        if self.args['read_only']:
+            print_records(records or [])
+            return
+        if records is None:
+            write_log(LOG_LEVEL.NOTICE, "No changes in " + name)
+            self.imported(import_type)
+            return
+
+        write_log(LOG_LEVEL.NOTICE, "Importing " + name + "...")
+        res = api.import_data(import_type, self.conn, self.warnings.indexed(import_type, records),
+                              self.poller, stats, self.journal, self.sizers.get(import_type))
+        res = res['import' + api.capfirst(import_type) + 's']
+        write_log(LOG_LEVEL.NOTICE,
+                  "Sent " + str(res['recordCount']) + " " + name + " in " +
+                  str(len(res['messageIds'])) + " batches")
+        self.pending.extend(res['messageIds'])
+        self.awaiting[import_type] = list(res['messageIds'])
+        if self.snapshots:
+            self.snapshots.submitted(import_type, res['messageIds'])
+        if self.journal:
+            self.journal.submitted(import_type)
+        if not self.args['pipelined']:
+            self.flush()
+
+    def flush(self):
+        """Waits for the imports sent so far to be processed."""
+        statuses = flush_pending(self.poller, self.pending, self.snapshots, self.journal,
+                                 self.warnings)
+        for status in statuses:
+            self.results[status['messageId']] = status['importStatus']
+        for import_type, msg_ids in list(self.awaiting.items()):
+            if all(msg_id in self.results for msg_id in msg_ids):
+                del self.awaiting[import_type]
+                results = [self.results.pop(msg_id) for msg_id in msg_ids]
+                if all(result == 'DONE' for result in results):
+                    self.imported(import_type)
+
+    def imported(self, import_type):
+        """Tells the source module that the records it returned for the import
+        type have been imported successfully, by calling its optional function
+        imported(props, import_type)."""
+        system = IMPORT_TYPES[import_type][0]
+        module = self.sources[system]
+        if hasattr(module, 'imported'):
+            module.imported(self.conn[system], import_type)
+
+
+def import_connection(conn, conn_name, args, poller, import_stats, journal=None,
+                      prefetcher=None, report=None, batch_sizes=None):
+    """Does the actual work of run_connection.
+
+    Args:
+        conn (dict): Parameters of the connection
+        conn_name (str): Name of the connection used in logs
+        args (dict): Command line arguments
+        poller (StatusPoller): Status poller of the connection
+        import_stats (dict): Counters of each import type are collected here
+        journal (ConnectionJournal, optional): Checkpoint journal of the connection
+        prefetcher (SourcePrefetcher, optional): If given, the sources are read
+            in background threads while the earlier imports are processed
+        report (WarningReport, optional): Warning report of the run
+        batch_sizes (BatchSizeStore, optional): Batch sizes learned by the runs; used
+            if enabled for the connection with 'adaptiveBatchSize'
+    """
+    write_log(LOG_LEVEL.INFO,
+              "Running import for '{}'".format(conn_name))
+
+    # When resuming, the imports finished by the interrupted run are skipped
+    if journal and args['resume']:
+        args = dict(args)
+        for import_type, argument in IMPORT_ARGUMENTS.items():
+            if args[argument] and journal.completed(import_type):
+                write_log(LOG_LEVEL.NOTICE,
+                          "Skipping {} import, finished by the interrupted run".format(import_type))
+                args[argument] = False
+
+    # Personnel and department data fetching is wrapped in one source file,
+    # absences in another one.
+    try:
+        sources = {system: importlib.import_module(conn[system]["moduleName"])
+                   for system in SOURCE_SYSTEMS}
+    except ModuleNotFoundError as e:
+        print("Module loading failed:", repr(e))
+        exit()
+
+    # The functions of the HRM module are called in the same order as without
+    # prefetching, in one thread, and the absences are read in another one
+    if prefetcher:
+        prefetcher.start([
+            [(import_type, getattr(sources[system], function), conn[system])
+             for import_type, (type_system, function, _, _) in IMPORT_TYPES.items()
+             if type_system == system and args[IMPORT_ARGUMENTS[import_type]]]
+            for system in SOURCE_SYSTEMS])
+
+    warnings = ConnectionWarnings(conn_name, report,
+                                  conn.get('warningExamples', DEFAULT_EXAMPLES),
+                                  conn.get('warningRecords', False))
+
+    # Batch sizes tuned by the processing times, if enabled for the connection
+    sizers = {import_type: batch_sizes.sizer(conn, conn_name, import_type)
+              for import_type, argument in IMPORT_ARGUMENTS.items()
+              if batch_sizes and args[argument]}
+
+    snapshots = None
+    if args['delta']:
+        snapshots = SnapshotStore(
+            conn.get('snapshotFile', default_snapshot_file(conn_name)),
+            reconcile=args['reconcile'], read_only=args['read_only'])
+
+    imports = ConnectionImport(conn, args, poller, import_stats, sources, journal, prefetcher,
+                               snapshots, warnings, sizers)
+    try:
+        for import_type, argument in IMPORT_ARGUMENTS.items():
+            # Employees refer to departments and cost centers, and absences to
+            # employees, so those imports must be finished first
+            if import_type in ['employee', 'absence']:
+                imports.flush()
+            if args[argument]:
+                imports.run_import(import_type)
+
+        imports.flush()
+    finally:
+        if snapshots:
+            snapshots.close()
+
+
+def run_connection_isolated(conn, conn_name, props, args, metrics, journal=None,
+                            report=None, batch_sizes=None):
+    """Runs the import of one connection in a worker thread, so that its
+    failure is logged instead of stopping the other connections.
+
+    Returns:
+        bool: Whether the import was run through
+    """
+    set_log_prefix(conn_name)
+    try:
+        run_connection(conn, conn_name, props, args, metrics, journal, report, batch_sizes)
+        return True
+    except (Exception, SystemExit) as e:
         write_log(LOG_LEVEL.CRITICAL,
-                  "Error     : " + status[0]['error'])
-    if status[0]['warnings']:
-        write_log(LOG_LEVEL.ERROR,
-                  "There were warnings:")
-        for warning in status[0]['warnings']:
-            write_log(LOG_LEVEL.ERROR,
-                      warning['warning'] + ' / ' + warning['externalId'])
+                  "Import for '{}' failed: {}".format(conn_name, repr(e)))
+        return False
 
 
 def main():
+    args = get_command_line_arguments()
+
     # Load the connection parameters or inform user that the parameter file is not found
-    props = load_properties()
+    props = load_properties(args['config'])
     if "logFile" in props:
         set_log_file(props["logFile"])
 
     if "logLevel" in props:
         set_log_level(LOG_LEVEL(props["logLevel"]))
 
-    args = get_command_line_arguments()
+    if "consoleLogLevel" in props:
+        set_console_level(LOG_LEVEL(props["consoleLogLevel"]))
+
+    # Timing and volume metrics are written in JSON lines format, if so configured
+    metrics = RunMetrics(props.get('metricsFile'))
 
-    # Run the imports for each connection
+    # Nothing is sent in read only mode, so there is nothing to record either
+    journal = None
+    if not args['read_only']:
+        journal = CheckpointJournal(props.get('checkpointFile', DEFAULT_CHECKPOINT_FILE),
+                                    resume=args['resume'])
+
+    # The batch sizes learned for the connections with adaptive batch sizes
+    batch_sizes = None
+    if not args['read_only']:
+        batch_sizes = BatchSizeStore(props.get('batchSizeFile', DEFAULT_BATCH_SIZE_FILE))
+
+    # All the warnings of the imports are written to one report, if so configured
+    report = None
+    if not args['read_only'] and props.get('warningReport'):
+        report = WarningReport(props['warningReport'])
+
+    # Collect the connections to be imported
+    connections = []
     index = 0
     for conn in props['connections']:
-        # If there is are connection specific log settings that should be used, they are set now
-        if "logFile" in conn:
-            set_log_file(conn["logFile"])
-        elif "logFile" in props:
-            set_log_file(props["logFile"])
-        else:
-            set_log_file(None)
-
-        if "logLevel" in conn:
-            set_log_level(LOG_LEVEL(conn["logLevel"]))
-        elif "logLevel" in props:
-            set_log_level(LOG_LEVEL(props["logLevel"]))
-        else:
-            set_log_level(None)
-
         index += 1
         conn_name = "Connection_#{}".format(index)
 
@@ -150,65 +619,43 @@ def main():
                           "Skipping import for '{}'".format(conn_name))
                 continue
 
-        write_log(LOG_LEVEL.INFO,
-                  "Running import for '{}'".format(conn_name))
-
-        # Personnel and department data fetching is wrapped in one source file,
-        # absences in another one.
+        # Only the connections to be imported are validated
         try:
-            hrm = importlib.import_module(
-                conn["hrMgmtSystem"]["moduleName"]
-            )
-            ttr = importlib.import_module(
-                conn["hourTrackingSystem"]["moduleName"]
-            )
-        except ModuleNotFoundError as e:
-            print("Module loading failed:", repr(e))
+            connections.append((resolve_connection(conn, conn_name), conn_name))
+        except PropertiesError as e:
+            print("Properties file not complete:")
+            print(repr(e))
             exit()
 
-        # Load department data from HRM adjacent system and push it to Aava-API
-        if args['import_departments']:
-            deps = hrm.get_departments(conn["hrMgmtSystem"])
-            if args['read_only']:
-                print(json.dumps(deps, indent=4, sort_keys=True))
-            else:
-                write_log(LOG_LEVEL.NOTICE,
-                          "Importing " + str(len(deps)) + " departments...")
-                res = api.import_departments(conn, deps)
-                process_results(conn, res['importDepartments']['messageId'])
-
-        # Load cost center data from HRM adjacent system and push it to Aava-API
-        if args['import_cost_centers']:
-            ccs = hrm.get_cost_centers(conn["hrMgmtSystem"])
-            if args['read_only']:
-                print(json.dumps(ccs, indent=4, sort_keys=True))
-            else:
-                write_log(LOG_LEVEL.NOTICE,
-                          "Importing " + str(len(ccs)) + " cost centers...")
-                res = api.import_cost_centers(conn, ccs)
-                process_results(conn, res['importCostCenters']['messageId'])
-
-        # Load employee data from HRM and push it to Aava-API
-        if args['import_employees']:
-            emps = hrm.get_personnel(conn["hrMgmtSystem"])
-            if args['read_only']:
-                print(json.dumps(emps, indent=4, sort_keys=True))
-            else:
-                write_log(LOG_LEVEL.NOTICE,
-                          "Importing " + str(len(emps)) + " employees...")
-                res = api.import_employees(conn, emps)
-                process_results(conn, res['importEmployees']['messageId'])
-
-        # Load absence data from hour trackin system and push it to Aava-API
-        if args['import_absences']:
-            abs = ttr.get_absences(conn["hourTrackingSystem"])
-            if args['read_only']:
-                print(json.dumps(abs, indent=4, sort_keys=True))
-            else:
-                write_log(LOG_LEVEL.NOTICE,
-                          "Importing " + str(len(abs)) + " absences...")
-                res = api.import_absences(conn, abs)
-                process_results(conn, res['importAbsences']['messageId'])
+    # Run the imports for each connection, either one after another or in a pool of
+    # worker threads. Each thread has its own log settings.
+    if args['parallel'] > 1:
+        with ThreadPoolExecutor(max_workers=args['parallel']) as executor:
+            results = list(executor.map(
+                lambda c: run_connection_isolated(c[0], c[1], props, args, metrics, journal,
+                                                  report, batch_sizes),
+                connections))
+        failed = [c[1] for c, ok in zip(connections, results) if not ok]
+        if failed:
+            write_log(LOG_LEVEL.CRITICAL,
+                      "Import failed for: {}".format(', '.join(failed)))
+    else:
+        for conn, conn_name in connections:
+            try:
+                run_connection(conn, conn_name, props, args, metrics, journal, report,
+                               batch_sizes)
+            except api.ApiError as e:
+                # The request was already retried as far as allowed, so give up on
+                # this connection but carry on with the others
+                write_log(LOG_LEVEL.CRITICAL,
+                          "Import for '{}' failed: {}".format(conn_name, e))
+
+    metrics.summary()
+    if journal:
+        journal.close()
+    if report:
+        report.close()
+    flush_logs()
 
 
 if __name__ == "__main__":
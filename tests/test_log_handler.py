@@ -0,0 +1,61 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from log_handler import LOG_LEVEL, LogWriter
+
+
+class LogWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.dir.name, 'log.txt')
+        self.writer = LogWriter(flush_interval=0.1)
+
+    def tearDown(self):
+        self.writer.close()
+        self.dir.cleanup()
+
+    def read(self):
+        with open(self.filename, encoding='utf-8') as log_file:
+            return log_file.read()
+
+    def flush(self):
+        flusher = threading.Thread(target=self.writer.flush, daemon=True)
+        flusher.start()
+        flusher.join(5)
+        self.assertFalse(flusher.is_alive(), "flush() did not return")
+
+    def test_non_ascii_message(self):
+        self.writer.write(self.filename, time.time(), LOG_LEVEL.ERROR, 'Äijälä ☃')
+        self.flush()
+        self.assertIn('Äijälä ☃', self.read())
+
+    def test_unwritable_file(self):
+        missing = os.path.join(self.dir.name, 'missing', 'log.txt')
+        self.writer.write(missing, time.time(), LOG_LEVEL.ERROR, 'lost')
+        self.writer.write(self.filename, time.time(), LOG_LEVEL.ERROR, 'kept')
+        self.flush()
+        self.assertIn('kept', self.read())
+
+    def test_failed_thread(self):
+        def fail(timestamp):
+            raise RuntimeError('failed')
+
+        self.writer.format_time = fail
+        self.writer.write(self.filename, time.time(), LOG_LEVEL.ERROR, 'lost')
+        self.flush()
+        self.writer.thread.join(5)
+        self.assertFalse(self.writer.thread.is_alive())
+
+        # The next line starts a new thread
+        del self.writer.format_time
+        self.writer.write(self.filename, time.time(), LOG_LEVEL.ERROR, 'kept')
+        self.flush()
+        self.assertIn('kept', self.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+import csv
+import json
+import threading
+from collections import Counter
+
+from log_handler import LOG_LEVEL, write_log
+
+# How many example IDs of each kind of warning and how many kinds of
+# warnings are logged; all of them are written to the report file
+DEFAULT_EXAMPLES = 5
+MAX_KINDS = 10
+
+REPORT_FIELDS = ['connection', 'importType', 'messageId', 'warning', 'externalId', 'records']
+
+
+def type_key(import_type):
+    """Returns a key that is equal for e.g. 'costCenter' used in the code and
+    'COST_CENTER' used in the status objects."""
+    return str(import_type).replace('_', '').lower()
+
+
+class WarningReport:
+    """Writes the warnings of the imports of a run to a report file, one row
+    for each warning, as they are received. The file is written in CSV format
+    if its name ends with '.csv' and in JSON lines format otherwise.
+
+    Args:
+        filename (str): Path of the report file, replaced if it exists
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.file = open(filename, 'w', newline='', encoding='utf-8')
+        self.csv = filename.lower().endswith('.csv')
+        if self.csv:
+            self.writer = csv.writer(self.file)
+            self.writer.writerow(REPORT_FIELDS)
+
+    def write(self, rows):
+        """Writes the warnings of one import.
+
+        Args:
+            rows (list): The rows as lists of the values in REPORT_FIELDS
+                order, the source records as a list of JSON strings or None
+        """
+        with self.lock:
+            for row in rows:
+                if self.csv:
+                    records = row[-1]
+                    self.writer.writerow(row[:-1] + [
+                        '[' + ','.join(records) + ']' if records is not None else ''])
+                else:
+                    entry = dict(zip(REPORT_FIELDS, row))
+                    if entry['records'] is None:
+                        del entry['records']
+                    else:
+                        entry['records'] = [json.loads(record) for record in entry['records']]
+                    self.file.write(json.dumps(entry) + '\n')
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class ConnectionWarnings:
+    """Handles the warnings of the imports of one connection: they are logged
+    grouped by kind, with counts and a few example IDs, instead of one line
+    each, and written to the report of the run, if there is one.
+
+    If 'index_records' is set, the records sent are kept as JSON by their
+    external IDs, so that the records that got warnings can be included in
+    the report.
+
+    Args:
+        conn_name (str): Name of the connection
+        report (WarningReport, optional): The report of the run
+        examples (int): Number of example IDs logged for each kind of warning
+        index_records (bool): Whether the records sent are kept for the report
+    """
+
+    def __init__(self, conn_name, report=None, examples=DEFAULT_EXAMPLES, index_records=False):
+        self.conn_name = conn_name
+        self.report = report
+        self.examples = examples
+        # import type key -> external ID -> records as JSON
+        self.index = {} if report and index_records else None
+
+    def indexed(self, import_type, records):
+        """Passes the records through, keeping them for the report if so
+        configured.
+
+        Args:
+            import_type (str): Type of the records (department, employee, ...)
+            records (iterable): The records to be sent
+        """
+        if self.index is None:
+            return records
+        index = self.index.setdefault(type_key(import_type), {})
+        return self.add_records(index, records)
+
+    def add_records(self, index, records):
+        for record in records:
+            if isinstance(record, dict) and record.get('externalId') is not None:
+                try:
+                    encoded = json.dumps(record)
+                except (TypeError, ValueError):
+                    encoded = None
+                if encoded:
+                    index.setdefault(str(record['externalId']), []).append(encoded)
+            yield record
+
+    def process(self, status):
+        """Logs the warnings of a finished import and writes them to the report.
+
+        Args:
+            status (dict): The status object of the import
+        """
+        warnings = status.get('warnings')
+        if not warnings:
+            return
+
+        counts = Counter()
+        examples = {}
+        for warning in warnings:
+            kind = warning['warning']
+            counts[kind] += 1
+            ids = examples.setdefault(kind, [])
+            if len(ids) < self.examples:
+                ids.append(str(warning['externalId']))
+
+        write_log(LOG_LEVEL.ERROR,
+                  "There were {} warnings:".format(len(warnings)))
+        for kind, count in counts.most_common(MAX_KINDS):
+            write_log(LOG_LEVEL.ERROR, "{} x {}, e.g. {}".format(
+                count, kind, ', '.join(examples[kind])))
+        if len(counts) > MAX_KINDS:
+            write_log(LOG_LEVEL.ERROR, "... and {} other kinds of warnings".format(
+                len(counts) - MAX_KINDS))
+
+        if self.report:
+            index = self.index.get(type_key(status['importType']), {}) \
+                if self.index is not None else None
+            self.report.write([
+                [self.conn_name, status['importType'], status['messageId'],
+                 warning['warning'], warning['externalId'],
+                 index.get(str(warning['externalId']), []) if index is not None else None]
+                for warning in warnings])
+            write_log(LOG_LEVEL.ERROR,
+                      "All the warnings are written to {}".format(self.report.filename))